@@ -0,0 +1,191 @@
+'''Benchmark of the stages of main.py on synthetic genealogies (synth.py).
+Each size is run in a fresh process, timing each stage and recording the
+peak memory (resident set size) during it. Results can be saved as a
+baseline, and are compared against a saved baseline to flag regressions.
+
+    python bench.py --sizes 10000,100000 --save-baseline
+    python bench.py --sizes 10000,100000
+'''
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+
+from main import (SuccessionGraph, SuccessionIndex, apply_illegitimates,
+    clean_descendants, get_succession, load_children, load_descendants,
+    load_illegitimates, successors_frame, verify_succession, write_json,
+    write_rank_histories, write_successors, write_timeline)
+from metrics import Metrics
+import synth
+
+# Dates to query the line at
+DATES = ['1714-08-01', '1901-01-22', '1936-12-11', '2020-01-01']
+
+def run_stages(descendants, illegitimates, seed, verify=False):
+    '''Run the stages of main.py on the descendants, writing the outputs to a
+    temporary directory. Returns the results of each stage.
+    '''
+    logging.getLogger().setLevel(logging.ERROR)
+    stages = Metrics()
+    with stages.stage('load'):
+        df = load_descendants(descendants)
+        children = load_children(descendants)
+    with stages.stage('illegitimates'):
+        apply_illegitimates(df, load_illegitimates(illegitimates))
+    with stages.stage('clean'):
+        df = clean_descendants(df)
+    df['legitimate_date'] = None
+    with stages.stage('graph'):
+        graph = SuccessionGraph(df, children=children)
+    with stages.stage('succession'):
+        entries = graph.succession(graph.node(seed))
+        successors_df = successors_frame(df, entries)
+    last_updated = datetime.utcnow().isoformat()
+    with tempfile.TemporaryDirectory() as directory:
+        path = lambda name: os.path.join(directory, name)
+        with stages.stage('export'):
+            write_successors(successors_df, path('successors.json'),
+                last_updated, path('successors.csv'))
+        with stages.stage('timeline'):
+            index = SuccessionIndex(successors_df)
+            write_timeline(index, path('timeline.json'), last_updated)
+        with stages.stage('histories'):
+            write_rank_histories(index, path('histories.json'),
+                last_updated, 100)
+    with stages.stage('lines'):
+        for date in DATES:
+            get_succession(successors_df, date, index)
+    if verify:
+        with stages.stage('verify'):
+            verify_succession(df, seed, successors_df)
+    names = ['load', 'illegitimates', 'clean', 'graph', 'succession',
+        'export', 'timeline', 'histories', 'lines']
+    if verify:
+        names.append('verify')
+    return {'descendants': len(df), 'successors': len(successors_df),
+        'stages': {name: {
+            'seconds': stages.get('stage_seconds', stage=name),
+            'peak_mb': stages.get('stage_peak_bytes', stage=name) / 2 ** 20,
+        } for name in names}}
+
+def generate(data, size, seed, fmt):
+    '''Paths of the synthetic descendants and illegitimacy rules of a size,
+    generating them if not already there.
+    '''
+    directory = os.path.join(data, f'{size}-{seed}')
+    descendants = os.path.join(directory,
+        'columns' if fmt == 'columns' else 'descendants.yml')
+    illegitimates = os.path.join(directory, 'illegitimates.yml')
+    if not os.path.exists(descendants) or not os.path.exists(illegitimates):
+        os.makedirs(directory, exist_ok=True)
+        synth.write(size, seed, descendants if fmt == 'columns' else None,
+            descendants if fmt == 'yaml' else None, illegitimates)
+    return descendants, illegitimates
+
+def compare(results, baseline, tolerance, memory_tolerance, min_seconds):
+    '''Log the results against the baseline. Returns the regressions.
+    '''
+    regressions = []
+    for size, result in results['sizes'].items():
+        base = baseline.get('sizes', {}).get(size, {}).get('stages', {})
+        for name, stage in result['stages'].items():
+            seconds, peak = stage['seconds'], stage['peak_mb']
+            line = f'{size:>8} {name:<14}{seconds:9.3f} s {peak:8.0f} MB'
+            if name in base:
+                base_seconds = base[name]['seconds']
+                base_peak = base[name]['peak_mb']
+                line += f'  (baseline {base_seconds:9.3f} s ' \
+                    f'{seconds / (base_seconds or 1e-9) - 1:+5.0%}, ' \
+                    f'{base_peak:8.0f} MB {peak / (base_peak or 1) - 1:+5.0%})'
+                slower = seconds > base_seconds * (1 + tolerance) \
+                    and seconds - base_seconds > min_seconds
+                larger = peak > base_peak * (1 + memory_tolerance)
+                if slower or larger:
+                    regressions.append((size, name))
+                    line += ' REGRESSION'
+            logging.info(line)
+    return regressions
+
+def main():
+
+    # Define and parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, default='10000,100000',
+        help='Comma separated numbers of descendants to benchmark.')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Random seed of the synthetic genealogies.')
+    parser.add_argument('--data', type=str, default='bench-data',
+        help='Directory to keep the generated genealogies in.')
+    parser.add_argument('--format', type=str, default='columns',
+        choices=['columns', 'yaml'],
+        help='Format of the descendants to load.')
+    parser.add_argument('--repeat', type=int, default=1,
+        help='Runs of each size, keeping the best of each stage.')
+    parser.add_argument('--verify', action='store_true',
+        help='Also time the reference implementation (slow).')
+    parser.add_argument('--baseline', type=str, default='bench-baseline.json',
+        help='Baseline results to compare against.')
+    parser.add_argument('--save-baseline', action='store_true',
+        help='Save the results as the baseline.')
+    parser.add_argument('--output', type=str, default=None,
+        help='JSON file for the results.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='Proportion slower than the baseline to flag a stage.')
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+        help='Proportion more peak memory than the baseline to flag a '
+            'stage.')
+    parser.add_argument('--min-seconds', type=float, default=0.1,
+        help='Smallest slowdown to flag (to ignore noise in quick stages).')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    results = {
+        'created': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'sizes': {},
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        descendants, illegitimates = generate(args.data, size, args.seed,
+            args.format)
+        logging.info(f'Benchmarking {descendants}...')
+        best = None
+        for _ in range(args.repeat):
+            # A fresh process for each run, so that memory is not shared
+            with multiprocessing.Pool(1) as pool:
+                result = pool.apply(run_stages, (descendants, illegitimates,
+                    synth.seed_id(), args.verify))
+            if best is None:
+                best = result
+                continue
+            for name, stage in result['stages'].items():
+                for key, value in stage.items():
+                    best['stages'][name][key] = min(best['stages'][name][key],
+                        value)
+        results['sizes'][str(size)] = best
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        logging.info(f'Comparing with baseline {args.baseline} (created '
+            f'{baseline.get("created")})')
+    regressions = compare(results, baseline, args.tolerance,
+        args.memory_tolerance, args.min_seconds)
+    if args.output:
+        write_json(args.output, results, indent=2)
+    if args.save_baseline:
+        write_json(args.baseline, results, indent=2)
+        logging.info(f'Saved baseline to {args.baseline}')
+    if regressions:
+        logging.error(f'{len(regressions)} stages regressed: {regressions}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
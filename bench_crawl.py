@@ -0,0 +1,99 @@
+'''Crawl benchmark for geni.py against the simulated Geni API (geni_sim.py).
+Runs a complete crawl for each engine and worker count, and reports the time
+to completion, throughput, idle rate limit quota, duplicate ids requested
+and the responses by status. A crawl which did not store every profile and
+union served (all descending from the seed) fails the benchmark.
+'''
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import geni_sim
+from geni import read_tables
+
+def crawl(url, seed, engine, workers, directory):
+    '''Run geni.py against the simulator. Returns the seconds taken and the
+    number of profiles and unions stored.
+    '''
+    db = os.path.join(directory, f'{engine}-{workers}.db')
+    command = [sys.executable, 'geni.py', '--base-url', url, '--seed', seed,
+        '--db', db, '--engine', engine, '--workers', str(workers),
+        '--output', '']
+    log_path = db.replace('.db', '.log')
+    start = time.perf_counter()
+    with open(log_path, 'w+') as log:
+        result = subprocess.run(command, stdout=log, stderr=log,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(f'Crawl failed (see {log_path})')
+    profiles, unions = read_tables(db)
+    return elapsed, len(profiles), len(unions)
+
+def main():
+
+    # Define and parse arguments
+    parser = argparse.ArgumentParser()
+    geni_sim.add_arguments(parser)
+    parser.add_argument('--seed', type=str, default='profile-1',
+        help='Seed profile to crawl from.')
+    parser.add_argument('--engines', type=str, default='threads,async',
+        help='Comma separated engines to benchmark.')
+    parser.add_argument('--workers', type=str, default='1,2,4,8',
+        help='Comma separated worker counts to benchmark (for the threads '
+            'engine).')
+    parser.add_argument('--output', type=str, default=None,
+        help='JSON file for the results.')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    server = geni_sim.serve(geni_sim.from_arguments(args))
+    url = f'http://127.0.0.1:{server.server_port}/api'
+    runs = [(engine, int(workers)) for engine in args.engines.split(',')
+        for workers in (args.workers.split(',') if engine == 'threads'
+            else [1])]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for engine, workers in runs:
+            server.geni.reset()
+            elapsed, profiles, unions = crawl(url, args.seed, engine, workers,
+                directory)
+            # A fast crawl which misses documents is not a result
+            served = {kind: len(table)
+                for kind, table in server.geni.tables.items()}
+            if (profiles, unions) != (served['profile'], served['union']):
+                raise RuntimeError(f'{engine} x{workers} stored {profiles} of '
+                    f'{served["profile"]} profiles and {unions} of '
+                    f'{served["union"]} unions')
+            stats = server.geni.stats()
+            ids = sum(stats['ids'].values())
+            result = {
+                'engine': engine,
+                'workers': workers,
+                'seconds': elapsed,
+                'profiles': profiles,
+                'unions': unions,
+                'ids_per_second': ids / elapsed,
+                **stats,
+            }
+            results.append(result)
+            logging.info(f'{engine:>7} x{workers}: {elapsed:7.1f} s, '
+                f'{profiles} profiles, {unions} unions, '
+                f'{stats["requests"]} requests, '
+                f'{result["ids_per_second"]:6.1f} ids/s, '
+                f'{stats["idle_quota"]:4.0%} idle quota, '
+                f'{sum(stats["duplicate_ids"].values())} duplicate ids, '
+                f'status {stats["status"]}')
+    server.shutdown()
+    if args.output:
+        with open(args.output, 'w+') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
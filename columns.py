@@ -0,0 +1,112 @@
+'''Columnar format for descendant rows, as an alternative to the YAML file
+passed between geni.py and main.py. Rows are stored as a directory of .npy
+files (which can be memory mapped) and a meta.json describing the columns.
+
+- String columns are fixed width unicode arrays with a null mask.
+- Boolean columns are int8 arrays (-1 for null).
+- Integer columns are int64 arrays with a null mask.
+- Lists of ids (e.g. children_ids) are adjacency lists in CSR form: an
+  indptr array (one more than the number of rows) and an array of integer
+  indices into the ids array. Ids which are referenced but have no row are
+  appended to the ids array after the rows.
+'''
+
+import json
+import os
+import numpy as np
+
+VERSION = 1
+
+def _column_type(values):
+    '''Infer the column type from the (non-null) values.
+    '''
+    values = [v for v in values if v is not None]
+    if values and all(isinstance(v, list) for v in values):
+        return 'ids'
+    if all(isinstance(v, bool) for v in values):
+        return 'bool'
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return 'int'
+    return 'str'
+
+def write_columns(rows, path, id_key='_id'):
+    '''Write rows (a list of dicts) to a columnar directory.
+    '''
+    keys = sorted(set(k for row in rows for k in row) - {id_key})
+    ids = [row[id_key] for row in rows]
+    index = {_id: i for i, _id in enumerate(ids)}
+    columns = {}
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        kind = _column_type(values)
+        if kind == 'ids':
+            indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+            indices = []
+            for i, value in enumerate(values):
+                for _id in value or []:
+                    if _id not in index:
+                        index[_id] = len(ids)
+                        ids.append(_id)
+                    indices.append(index[_id])
+                indptr[i+1] = len(indices)
+            columns[key] = (kind, (indptr, np.array(indices, dtype=np.int32)))
+            continue
+        isnull = np.array([v is None for v in values], dtype=bool)
+        if kind == 'bool':
+            columns[key] = (kind, np.array(
+                [-1 if v is None else int(v) for v in values], dtype=np.int8))
+        elif kind == 'int':
+            columns[key] = (kind, (np.array([v or 0 for v in values], 
+                dtype=np.int64), isnull))
+        else:
+            columns[key] = (kind, (np.array(
+                ['' if v is None else str(v) for v in values], dtype=str), 
+                isnull))
+    write_arrays(path, np.array(ids, dtype=str), len(rows), columns, id_key)
+
+def write_arrays(path, ids, rows, columns, id_key='_id'):
+    '''Write columns already in array form (as returned by read_columns, 
+    but keyed to (kind, arrays) tuples) to a columnar directory. The ids 
+    array holds the ids of the rows, then any referenced-only ids.
+    '''
+    os.makedirs(path, exist_ok=True)
+    meta = {'version': VERSION, 'rows': rows, 'columns': {}}
+    for key, (kind, arrays) in sorted(columns.items()):
+        meta['columns'][key] = kind
+        if kind == 'ids':
+            indptr, indices = arrays
+            np.save(os.path.join(path, f'{key}.indptr.npy'), indptr)
+            np.save(os.path.join(path, f'{key}.npy'), indices)
+        elif kind == 'bool':
+            np.save(os.path.join(path, f'{key}.npy'), arrays)
+        else:
+            values, isnull = arrays
+            np.save(os.path.join(path, f'{key}.npy'), values)
+            np.save(os.path.join(path, f'{key}.isnull.npy'), isnull)
+    np.save(os.path.join(path, f'{id_key}.npy'), ids)
+    meta['id_key'] = id_key
+    with open(os.path.join(path, 'meta.json'), 'w+') as f:
+        json.dump(meta, f, indent=2)
+
+def read_columns(path, mmap_mode='r'):
+    '''Read a columnar directory. Returns the meta dictionary, the ids array
+    (rows first, then referenced-only ids), and a dictionary of columns.
+    String/int columns are (values, isnull) tuples, bool columns are int8
+    arrays, and ids columns are (indptr, indices) tuples.
+    '''
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != VERSION:
+        raise ValueError(f'Unsupported columns version in {path}')
+    load = lambda name: np.load(os.path.join(path, f'{name}.npy'),
+        mmap_mode=mmap_mode)
+    ids = load(meta['id_key'])
+    columns = {}
+    for key, kind in meta['columns'].items():
+        if kind == 'ids':
+            columns[key] = (load(f'{key}.indptr'), load(key))
+        elif kind == 'bool':
+            columns[key] = load(key)
+        else:
+            columns[key] = (load(key), load(f'{key}.isnull'))
+    return meta, ids, columns
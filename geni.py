@@ -3,21 +3,30 @@
 '''
 
 import argparse
+import asyncio
+from collections import deque
+from contextlib import contextmanager
 from datetime import date
-from functools import wraps
+from functools import lru_cache
+import heapq
+import itertools
+import json
 import logging
+import multiprocessing
 import queue
+import random
 import requests
+import sqlite3
+import sys
 import threading
 import time
-from tinydb import TinyDB
-from tinydb.table import Document
-from tinydb.middlewares import CachingMiddleware
-from tinydb.storages import MemoryStorage, JSONStorage
 from uuid import NAMESPACE_X500, uuid5
 import yaml
 
-logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+from columns import write_columns
+import metrics
+
+logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
 # Base Geni API url
 BASE = 'https://www.geni.com/api'
@@ -26,6 +35,14 @@ BASE = 'https://www.geni.com/api'
 # to give some wiggle room.
 RATE_LIMIT = 9
 RATE_WINDOW = 11
+# Failed requests are retried with jittered exponential backoff
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 1
+BACKOFF_CAP = 120
+# Request timeout in seconds
+TIMEOUT = 60
+# Maximum concurrent requests for the async engine
+ASYNC_MAX_IN_FLIGHT = 2 * RATE_LIMIT
 # Maximum number of IDs per request.
 # This appears to be 50 for basic accounts before pagination occurs.
 # This can be set lower to increase parallelisation ability.
@@ -49,137 +66,766 @@ UNION_FIELDS = ','.join([
     'adopted_children', 'foster_children', # subsets of children
 ])
 
-class RateLimiter(object):
-    '''Thread-safe rate limiter.
+class Table(object):
+    '''Table of raw Geni documents keyed by numeric Geni id. Membership is 
+    checked against an in-memory set of ids rather than the database. 
+    Inserted documents are passed to on_insert, if set.
+    '''
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+        self.on_insert = None
+        cursor = store._conn.execute(f'SELECT id FROM {name}')
+        self._ids = set(row[0] for row in cursor)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        with self._store._lock:
+            cursor = self._store._conn.execute(
+                f'SELECT data FROM {self._name} ORDER BY id')
+            rows = cursor.fetchall()
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def contains(self, doc_id):
+        return doc_id in self._ids
+
+    def get(self, doc_id):
+        with self._store._lock:
+            cursor = self._store._conn.execute(
+                f'SELECT data FROM {self._name} WHERE id = ?', (doc_id,))
+            row = cursor.fetchone()
+        return row and json.loads(row[0])
+
+    def insert(self, doc_id, document):
+        '''Insert the document if not already present. Returns whether the 
+        document was inserted.
+        '''
+        with self._store._lock:
+            if doc_id in self._ids:
+                return False
+            with metrics.timer('geni_store_insert_seconds', table=self._name):
+                self._store._conn.execute(
+                    f'INSERT INTO {self._name} (id, data) VALUES (?, ?)', 
+                    (doc_id, json.dumps(document)))
+            self._ids.add(doc_id)
+            if self._store._depth:
+                self._store._inserted.append((self, doc_id))
+            metrics.gauge('geni_stored', len(self._ids), table=self._name)
+            self._store._written()
+        if self.on_insert:
+            self.on_insert(document)
+        return True
+
+class Store(object):
+    '''Local SQLite database of raw Geni responses and the pending endpoint 
+    queue. Writes are committed in batches so that a crashed or killed run 
+    loses at most one batch, and can be resumed from the pending queue.
     '''
-    def __init__(self, limit, window):
-        '''Ensures that there is no window period where there is more than 
-        limit calls.
+    def __init__(self, path, batch_size=200, batch_interval=10):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._inserted = []
+        self._writes = 0
+        self._committed_at = time.time()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        for name in ['profiles', 'unions']:
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS {name} '
+                '(id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS pending '
+            '(kind TEXT NOT NULL, geni_id TEXT NOT NULL, '
+            'PRIMARY KEY (kind, geni_id))')
+        self._conn.commit()
+        self.profiles = Table(self, 'profiles')
+        self.unions = Table(self, 'unions')
+
+    @contextmanager
+    def transaction(self):
+        '''Group writes which must be committed together (e.g. the records 
+        from a response and the endpoints found from them). The writes are 
+        rolled back if an error is raised, so that records are never 
+        committed without the ids found from them.
+        '''
+        with self._lock:
+            outer = not self._depth
+            if outer:
+                # A savepoint within the current batch, which may hold the 
+                # uncommitted writes of earlier transactions
+                if not self._conn.in_transaction:
+                    self._conn.execute('BEGIN')
+                self._conn.execute('SAVEPOINT batch')
+                self._inserted = []
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                if outer:
+                    self._rollback()
+                raise
+            finally:
+                self._depth -= 1
+            if outer:
+                self._conn.execute('RELEASE batch')
+                self._written(0)
+
+    def _rollback(self):
+        self._conn.execute('ROLLBACK TO batch')
+        self._conn.execute('RELEASE batch')
+        for table, doc_id in self._inserted:
+            table._ids.discard(doc_id)
+            metrics.gauge('geni_stored', len(table._ids), table=table._name)
+        logging.warning(f'Rolled back {len(self._inserted)} inserted records')
+        self._inserted = []
+
+    def _written(self, count=1):
+        '''Count writes and commit the batch when full or old enough, unless 
+        within a transaction.
+        '''
+        self._writes += count
+        if self._depth or not self._writes:
+            return
+        if self._writes >= self.batch_size \
+                or time.time() - self._committed_at >= self.batch_interval:
+            self.commit()
+
+    def commit(self):
+        with self._lock, metrics.timer('geni_store_commit_seconds'):
+            self._conn.commit()
+            logging.info(f'Committed {self._writes} writes; stored '
+                f'{len(self.profiles)} profiles and {len(self.unions)} unions')
+            self._writes = 0
+            self._committed_at = time.time()
+
+    def push(self, kind, geni_ids):
+        '''Add ids of a kind (profile or union) to the pending queue.
+        '''
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO pending (kind, geni_id) VALUES (?, ?)', 
+                [(kind, geni_id) for geni_id in geni_ids])
+            self._written(len(geni_ids))
+
+    def done(self, kind, geni_ids):
+        '''Remove requested ids from the pending queue.
+        '''
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM pending WHERE kind = ? AND geni_id = ?', 
+                [(kind, geni_id) for geni_id in geni_ids])
+            self._written(len(geni_ids))
+
+    def pending(self):
+        '''List (kind, geni id) tuples of the pending queue.
         '''
-        self.limit = limit
-        self.window = window
-        self._timestamps = []
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT kind, geni_id FROM pending ORDER BY rowid')
+            return cursor.fetchall()
+
+    def clear_pending(self):
+        with self._lock:
+            count = self._conn.execute('DELETE FROM pending').rowcount
+            self._written()
+            return count
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._conn.close()
+
+def read_tables(path):
+    '''Read the profiles and unions of a previous database into dictionaries 
+    keyed by numeric Geni id. Legacy TinyDB JSON files are also accepted.
+    '''
+    if path.endswith('.json'):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return tuple({int(doc_id): document for doc_id, document 
+            in data.get(name, {}).items()} for name in ['profiles', 'unions'])
+    store = Store(path)
+    tables = tuple({int(document['id'].split('-')[1]): document 
+        for document in table} for table in [store.profiles, store.unions])
+    store.close()
+    return tables
+
+class TokenBucket(object):
+    '''Thread-safe token bucket rate limiter. Tokens refill continuously at 
+    limit per window up to a capacity of burst, so requests are paced evenly 
+    across the window. The rate adapts to the rate limit headers returned by 
+    Geni, and is halved (recovering gradually) on 429 responses.
+    '''
+    def __init__(self, limit, window, burst=1):
+        self.nominal_rate = limit / window
+        self.rate = self.nominal_rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
         self._lock = threading.Lock()
 
-    def __call__(self, func):
-        '''Decorator.
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def reserve(self):
+        '''Take a token and return the number of seconds to wait before 
+        using it. The wait is done by the caller, outside of the lock.
+        '''
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+    def delay(self):
+        '''Seconds until a token is available.
+        '''
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0, (1 - self._tokens) / self.rate)
+
+    def update(self, status, headers):
+        '''Adapt to the response status and rate limit headers.
+        '''
+        with self._lock:
+            self._refill(time.monotonic())
+            limit = headers.get('X-API-Rate-Limit')
+            window = headers.get('X-API-Rate-Window')
+            if limit and window:
+                # Keep the same wiggle room as the default rate
+                rate = max(int(limit) - 1, 1) / (int(window) + 1)
+                self.nominal_rate = rate
+                self.rate = min(self.rate, rate)
+            if headers.get('X-API-Rate-Remaining') == '0':
+                self._tokens = min(self._tokens, 0)
+            if status == 429:
+                self.rate = max(self.rate / 2, self.nominal_rate / 16)
+                try:
+                    retry_after = float(headers.get('Retry-After'))
+                except (TypeError, ValueError):
+                    retry_after = 1 / self.rate
+                self._tokens = min(self._tokens, -retry_after * self.rate)
+                logging.warning(f'Rate limited; pausing {retry_after:.2f} '
+                    f'seconds and reducing rate to {self.rate:.2f}/s')
+            elif status < 400:
+                self.rate = min(self.nominal_rate, 
+                    self.rate + self.nominal_rate / 20)
+
+# Priority of ids with nothing known about them
+UNKNOWN = float('inf')
+
+class Priorities(object):
+    '''Priorities of the ids to request, as sort keys (lowest first) of the 
+    position in the current line (from a previous successors file), the 
+    generation depth from the seed, and whether the profile is dead. Depths 
+    are learnt from the unions as they arrive (or from a previous database), 
+    and a union takes the priority of the most important profile linking it.
+    '''
+    def __init__(self, seed, positions=None):
+        self.seed = seed
+        self.positions = positions or {}
+        self.depths = {seed: 0}
+        self.dead = set()
+        self.unions = {}
+
+    def __call__(self, kind, geni_id):
+        if kind == 'union':
+            return self.unions.get(geni_id, (UNKNOWN, UNKNOWN, True))
+        return (self.positions.get(geni_id_to_uuid(geni_id), UNKNOWN),
+            self.depths.get(geni_id, UNKNOWN), geni_id in self.dead)
+
+    def learn(self, kind, response):
+        '''Learn from the results of a response, before the ids found from 
+        them are scheduled.
+        '''
+        for result in response.get('results') or [response]:
+            if not result.get('id'):
+                continue
+            if kind == 'profile':
+                self.learn_profile(result)
+            else:
+                self.learn_union(result)
+
+    def learn_profile(self, profile):
+        geni_id = profile['id']
+        if profile.get('is_alive') is False:
+            self.dead.add(geni_id)
+        key = self('profile', geni_id)
+        for u in profile.get('unions', []):
+            union_id = u.split('/')[-1]
+            self.unions[union_id] = min(self.unions.get(union_id, key), key)
+
+    def learn_union(self, union):
+        '''Learn the depth of the children, as one more than the shallowest 
+        partner (or the same as the shallowest sibling, for the children of 
+        the seed's parents). Returns the children whose depth was lowered.
         '''
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            with self._lock:
-                now = time.time()
-                # Keep the timestamps still within window
-                self._timestamps = [t for t in self._timestamps 
-                    if (now - t) < self.window]
-                # If we are at the limit, then wait
-                if len(self._timestamps) == self.limit:
-                    earliest_timestamp = self._timestamps[0]
-                    wait = earliest_timestamp + self.window - now
-                    logging.info(f'Waiting {wait:.2f} seconds for rate limit')
-                    time.sleep(wait)
-                # Append the timestamp right before running the func
-                _timestamp = time.time()
-                self._timestamps.append(_timestamp)
-            return func(*args, **kwargs)
-        return wrapper
-
-@RateLimiter(limit=RATE_LIMIT, window=RATE_WINDOW)
-def request(session, endpoint):
-    '''Make a rate-limited request to the Geni API.
+        partners = [self.depths.get(p.split('/')[-1], UNKNOWN) 
+            for p in union.get('partners', [])]
+        children = [c.split('/')[-1] for c in union.get('children', [])]
+        depth = min(partners, default=UNKNOWN) + 1
+        if depth == UNKNOWN:
+            depth = min((self.depths.get(c, UNKNOWN) for c in children), 
+                default=UNKNOWN)
+        lowered = [c for c in children if depth < self.depths.get(c, UNKNOWN)]
+        for geni_id in lowered:
+            self.depths[geni_id] = depth
+        return lowered
+
+    def learn_tables(self, profiles, unions):
+        '''Learn from stored profiles and unions (e.g. of a previous run), 
+        walking down from the seed.
+        '''
+        walk = deque([self.seed])
+        while walk:
+            profile = profiles.get(int(walk.popleft().split('-')[1]))
+            if not profile:
+                continue
+            self.learn_profile(profile)
+            for u in profile.get('unions', []):
+                union = unions.get(int(u.split('-')[-1]))
+                if union:
+                    walk.extend(self.learn_union(union))
+
+def load_positions(path):
+    '''Positions in the current line of the successors in a successors JSON 
+    file written by main.py, by _id.
     '''
-    return session.get(endpoint)
+    with open(path, 'r') as f:
+        successors = json.load(f)['successors']
+    today = date.today().isoformat()
+    positions = {}
+    for s in successors:
+        if s.get('death_date') or (s.get('birth_date') or '') > today \
+                or (s.get('illegitimate_date') or '9999') <= today \
+                or (s.get('legitimate_date') or '') > today:
+            continue
+        positions.setdefault(s['_id'], len(positions))
+    return positions
+
+class Scheduler(object):
+    '''Gathers the ids to request into batches of up to MAX_IDS. Ids which 
+    are already stored, pending or in flight are not requested again. A 
+    partial batch is only flushed when the limiter would otherwise sit idle. 
+    Ids are requested in order of priority if given (otherwise in the order 
+    found), until the budget of requests or the deadline (in seconds) is 
+    exhausted.
+    '''
+    def __init__(self, store, limiter, priorities=None, max_requests=None,
+            deadline=None):
+        self.store = store
+        self.limiter = limiter
+        self.priorities = priorities
+        self.max_requests = max_requests
+        self.deadline = deadline and time.monotonic() + deadline
+        self._tables = {'profile': store.profiles, 'union': store.unions}
+        # Heaps of (priority, order found, id)
+        self._pending = {'profile': [], 'union': []}
+        self._pending_ids = {'profile': set(), 'union': set()}
+        self._in_flight = {'profile': set(), 'union': set()}
+        self._order = itertools.count()
+        self._cond = threading.Condition(threading.RLock())
+        self.requests = 0
+        self.requested_ids = 0
+        self.duplicates = 0
+
+    def add(self, kind, geni_ids):
+        '''Add ids to request. Returns the ids which were not duplicates.
+        '''
+        added = []
+        with self._cond:
+            pending = self._pending_ids[kind]
+            for geni_id in geni_ids:
+                doc_id = int(geni_id.split('-')[1])
+                if geni_id in pending or geni_id in self._in_flight[kind] \
+                        or self._tables[kind].contains(doc_id):
+                    self.duplicates += 1
+                    continue
+                priority = self.priorities(kind, geni_id) \
+                    if self.priorities else ()
+                heapq.heappush(self._pending[kind], 
+                    (priority, next(self._order), geni_id))
+                pending.add(geni_id)
+                added.append(geni_id)
+            if added:
+                self._record()
+                self._cond.notify_all()
+        return added
+
+    def learn(self, kind, response):
+        if self.priorities:
+            with self._cond:
+                self.priorities.learn(kind, response)
+
+    def take(self):
+        '''Take the next batch to request, as a (kind, ids, wait) tuple where 
+        wait is the seconds to wait on the limiter token reserved for it. 
+        Returns None if there is no batch to request yet.
+        '''
+        with self._cond:
+            if self.exhausted():
+                return None
+            kinds = [k for k in self._pending if self._pending[k]]
+            if self.limiter.delay() > 0:
+                kinds = [k for k in kinds if len(self._pending[k]) >= MAX_IDS]
+            if not kinds:
+                return None
+            if self.priorities:
+                kind = min(kinds, key=lambda k: self._pending[k][0][:2])
+            else:
+                kind = max(kinds, key=lambda k: len(self._pending[k]))
+            pending = self._pending[kind]
+            ids = [heapq.heappop(pending)[2] 
+                for _ in range(min(MAX_IDS, len(pending)))]
+            self._pending_ids[kind].difference_update(ids)
+            self._in_flight[kind].update(ids)
+            self.requests += 1
+            self.requested_ids += len(ids)
+            metrics.inc('geni_requested_ids_total', len(ids), kind=kind)
+            self._record()
+            return kind, ids, self.limiter.reserve()
+
+    def get(self):
+        '''Blocking take for worker threads. Returns None when finished.
+        '''
+        with self._cond:
+            while True:
+                batch = self.take()
+                if batch or self.finished():
+                    return batch
+                self._cond.wait(self.poll_interval())
+
+    def done(self, kind, geni_ids):
+        '''Mark requested ids as no longer in flight.
+        '''
+        with self._cond:
+            self._in_flight[kind].difference_update(geni_ids)
+            self._record()
+            self._cond.notify_all()
+
+    def exhausted(self):
+        '''Whether the budget of requests or the deadline has been reached.
+        '''
+        return (self.max_requests is not None 
+            and self.requests >= self.max_requests) \
+            or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(ids) for ids in self._pending_ids.values())
+
+    def finished(self):
+        '''Whether there is nothing more to request (or the budget is 
+        exhausted) and nothing in flight.
+        '''
+        with self._cond:
+            return (self.exhausted() or not any(self._pending.values())) \
+                and not any(self._in_flight.values())
+
+    def poll_interval(self):
+        '''Seconds to wait before a partial batch may be flushed, or None if 
+        there is nothing to take until a request completes.
+        '''
+        with self._cond:
+            if any(self._pending.values()) and not self.exhausted():
+                if self.deadline is not None:
+                    return min(max(self.limiter.delay(), 0.01), 
+                        max(self.deadline - time.monotonic(), 0.01))
+                return max(self.limiter.delay(), 0.01)
+            return None
+
+    def fill_ratio(self):
+        return self.requested_ids / (self.requests * MAX_IDS or 1)
+
+    def _record(self):
+        for kind in self._pending:
+            metrics.gauge('geni_queue_depth', len(self._pending[kind]), 
+                kind=kind)
+            metrics.gauge('geni_in_flight', len(self._in_flight[kind]), 
+                kind=kind)
+        metrics.gauge('geni_batch_fill_ratio', self.fill_ratio())
+
+def endpoint(kind, geni_ids):
+    '''Endpoint to request the given profile or union ids.
+    '''
+    fields = PROFILE_FIELDS if kind == 'profile' else UNION_FIELDS
+    return f'{BASE}/{kind}?ids={",".join(geni_ids)}&fields={fields}'
+
+def backoff(attempt):
+    '''Jittered exponential backoff in seconds for a retry attempt.
+    '''
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def error_status(err):
+    '''Status code of a failed request for the retry metrics, or the type of 
+    error if there was no response.
+    '''
+    status = getattr(getattr(err, 'response', None), 'status_code', None) \
+        or getattr(err, 'status', None)
+    return str(status) if status else type(err).__name__
+
+def record_response(status):
+    metrics.inc('geni_responses_total', status=status)
+    metrics.gauge('geni_last_response_time', time.time())
+
+def fetch(session, endpoint, limiter, wait=0):
+    '''Make a rate-limited request to the Geni API, retrying failures with 
+    backoff. The first attempt uses a token already reserved with the given 
+    wait. Returns the response JSON, or None if all attempts failed.
+    '''
+    for attempt in range(MAX_ATTEMPTS):
+        wait = limiter.reserve() if attempt else wait
+        metrics.observe('geni_limiter_wait_seconds', wait)
+        if wait:
+            logging.debug(f'Waiting {wait:.2f} seconds for rate limit')
+            time.sleep(wait)
+        try:
+            metrics.inc('geni_requests_total')
+            r = session.get(endpoint, timeout=TIMEOUT)
+            record_response(r.status_code)
+            limiter.update(r.status_code, r.headers)
+            r.raise_for_status()
+            return r.json()
+        except (requests.exceptions.RequestException, ValueError) as err:
+            metrics.inc('geni_retries_total', status=error_status(err))
+            delay = backoff(attempt)
+            logging.warning(f'Request to {endpoint} failed with error "{err}"; '
+                f'Retrying in {delay:.2f} seconds...')
+            time.sleep(delay)
+    logging.error(f'Giving up on {endpoint} after {MAX_ATTEMPTS} attempts')
+    metrics.inc('geni_failed_requests_total')
+    return None
 
-def handle_profile(response, profiles, unions, lock):
+def handle_profile(response, profiles, unions):
     '''Handle profile response.
     '''
     results = response.get('results') or [response]
     get_union_ids = []
+    fetched_at = int(time.time())
     for result in results:
         if not result.get('id'):
             logging.warning(f'Skipping result with no ID: {result}')
             continue
+        # Stamp the time of the request for later staleness checks
+        result['_fetched_at'] = fetched_at
         # Split id from geni id
         doc_id = int(result['id'].split('-')[1])
-        document = Document(result, doc_id=doc_id)
         name = result.get('name')
-        with lock:
-            # If the profile is already in the database then end here
-            if profiles.contains(doc_id=doc_id):
-                logging.debug(f'Profile {name} already present!')
-                continue
-            # Store it in the database
-            profiles.insert(document)
-            logging.info(f'Added profile #{profiles.__len__()}: {name}')
-        # Construct query to unseen unions
+        # Store it in the database, unless already present
+        if not profiles.insert(doc_id, result):
+            logging.debug(f'Profile {name} already present!')
+            continue
+        logging.debug(f'Added profile #{len(profiles)}: {name}')
+        # Gather unseen unions
         for u in result.get('unions', []):
             geni_id = u.split('/')[-1]
             doc_id = int(geni_id.split('-')[1])
-            with lock:
-                present = unions.contains(doc_id=doc_id)
-            if not present:
+            if not unions.contains(doc_id):
                 get_union_ids.append(geni_id)
-    # Split into batches
-    for i in range(0, len(get_union_ids), MAX_IDS):
-        ids = get_union_ids[i:i+MAX_IDS]
-        yield f'{BASE}/union?ids={",".join(ids)}&fields={UNION_FIELDS}'
+    return 'union', get_union_ids
 
-def handle_union(response, profiles, unions, lock):
+def handle_union(response, profiles, unions):
     '''Handle union response.
     '''
     results = response.get('results') or [response]
     get_child_ids = []
     for result in results:
         doc_id = int(result['id'].split('-')[1])
-        document = Document(result, doc_id=doc_id)
-        with lock:
-            # If the union is already in the database then end here
-            if unions.contains(doc_id=doc_id):
-                logging.debug(f'Union {doc_id} already present!')
-                continue
-            # Store it in the database
-            unions.insert(document)
-            logging.info(f'Added union #{unions.__len__()}')
-        # Construct query to unseen children profiles. These will either be 
+        # Store it in the database, unless already present
+        if not unions.insert(doc_id, result):
+            logging.debug(f'Union {doc_id} already present!')
+            continue
+        logging.debug(f'Added union #{len(unions)}')
+        # Gather unseen children profiles. These will either be 
         # the brothers/sisters or the children of the originating profile.
         for c in result.get('children', []):
             geni_id = c.split('/')[-1]
             doc_id = int(geni_id.split('-')[1])
-            with lock:
-                present = profiles.contains(doc_id=doc_id)
-            if not present:
+            if not profiles.contains(doc_id):
                 get_child_ids.append(geni_id)
-    # Split into batches
-    for i in range(0, len(get_child_ids), MAX_IDS):
-        ids = get_child_ids[i:i+MAX_IDS]
-        yield f'{BASE}/profile?ids={",".join(ids)}&fields={PROFILE_FIELDS}'
-
-def worker(q, session, profiles, unions, lock):
-    '''Worker thread which takes work from the queue makes a single request
-    to the Geni API.
+    return 'profile', get_child_ids
+
+def handle_response(store, scheduler, kind, geni_ids, response):
+    '''Handle a response for a batch of requested ids, and schedule the ids 
+    found from it.
+    '''
+    handle = handle_profile if kind == 'profile' else handle_union
+    # Records, the ids found from them, and completion of the batch are 
+    # committed together so that a resumed run is consistent
+    scheduler.learn(kind, response)
+    with store.transaction():
+        next_kind, next_ids = handle(response, store.profiles, store.unions)
+        store.push(next_kind, scheduler.add(next_kind, next_ids))
+        store.done(kind, geni_ids)
+
+def worker(session, store, scheduler):
+    '''Worker thread which takes batches from the scheduler and makes a 
+    single request for each to the Geni API.
     '''
     while True:
-        # Grab from the queue TODO
-        logging.debug(f'Queue length is: {q.qsize()}')
-        endpoint = q.get()
-        logging.info(f'Requesting endpoint: {endpoint}')
-        r = request(session, endpoint)
-        # Handle failures
+        batch = scheduler.get()
+        if batch is None:
+            return
+        kind, geni_ids, wait = batch
+        url = endpoint(kind, geni_ids)
+        logging.debug(f'Requesting endpoint: {url}')
+        response = fetch(session, url, scheduler.limiter, wait)
+        # Failed ids are left pending in the store for a resumed run
         try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError as err:
+            if response is not None:
+                handle_response(store, scheduler, kind, geni_ids, response)
+        except Exception:
+            logging.exception(f'Failed to handle the response from {url}')
+        finally:
+            scheduler.done(kind, geni_ids)
+
+async def fetch_async(session, endpoint, limiter, wait=0):
+    '''Asynchronous equivalent of fetch.
+    '''
+    import aiohttp
+    for attempt in range(MAX_ATTEMPTS):
+        wait = limiter.reserve() if attempt else wait
+        metrics.observe('geni_limiter_wait_seconds', wait)
+        await asyncio.sleep(wait)
+        try:
+            metrics.inc('geni_requests_total')
+            async with session.get(endpoint) as r:
+                record_response(r.status)
+                limiter.update(r.status, r.headers)
+                r.raise_for_status()
+                return await r.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            metrics.inc('geni_retries_total', status=error_status(err))
+            delay = backoff(attempt)
             logging.warning(f'Request to {endpoint} failed with error "{err}"; '
-                'Returning task to the queue...')
-            q.put(endpoint)
-            q.task_done()
-        response = r.json()
-        if '/profile' in endpoint:
-            for endpoint in handle_profile(response, profiles, unions, lock):
-                q.put(endpoint)
+                f'Retrying in {delay:.2f} seconds...')
+            await asyncio.sleep(delay)
+    logging.error(f'Giving up on {endpoint} after {MAX_ATTEMPTS} attempts')
+    metrics.inc('geni_failed_requests_total')
+    return None
+
+async def crawl_async(store, scheduler):
+    '''Crawl from the scheduled ids in a single thread. Requests are 
+    dispatched as soon as the limiter allows (up to ASYNC_MAX_IN_FLIGHT at 
+    once), so the quota is not left unused while responses are outstanding.
+    '''
+    import aiohttp
+    in_flight = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+    changed = asyncio.Event()
+    tasks = set()
+
+    async def run(kind, geni_ids, wait):
+        try:
+            url = endpoint(kind, geni_ids)
+            logging.debug(f'Requesting endpoint: {url}')
+            response = await fetch_async(session, url, scheduler.limiter, wait)
+            if response is not None:
+                handle_response(store, scheduler, kind, geni_ids, response)
+        except Exception:
+            logging.exception(f'Failed to handle the response from {url}')
+        finally:
+            scheduler.done(kind, geni_ids)
+            in_flight.release()
+            changed.set()
+
+    connector = aiohttp.TCPConnector(limit=ASYNC_MAX_IN_FLIGHT)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout) as session:
+        while not scheduler.finished():
+            await in_flight.acquire()
+            batch = scheduler.take()
+            if batch is None:
+                in_flight.release()
+                changed.clear()
+                try:
+                    await asyncio.wait_for(changed.wait(), 
+                        scheduler.poll_interval())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.ensure_future(run(*batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+def is_stale(profile, now, max_age, living_max_age):
+    '''Determine whether a previously fetched profile should be requested 
+    again. Living profiles (where births/deaths are expected) are stale after 
+    living_max_age days. Otherwise the revisit interval is the time the 
+    profile had gone unedited (from updated_at) when it was fetched, bounded 
+    by max_age days, so that quiet historical profiles are rarely requested.
+    '''
+    fetched_at = profile.get('_fetched_at')
+    if not fetched_at:
+        return True
+    age = now - fetched_at
+    if profile.get('is_alive') or profile.get('living'):
+        return age >= living_max_age * 86400
+    try:
+        quiet = fetched_at - float(profile.get('updated_at'))
+    except (TypeError, ValueError):
+        quiet = 0
+    return age >= min(max(quiet, 0), max_age * 86400)
+
+def seed_from_previous(path, profiles, unions, seed, args, priorities=None):
+    '''Seed the local database from a previous database. Fresh profiles are 
+    copied across, as are unions which have no stale partner. Returns the 
+    ids of each kind to request: the stale profiles, and the children and 
+    unions linked from copied documents which are not in the database (e.g. 
+    from a failed request). New unions and children are then discovered from 
+    these as usual.
+    '''
+    now = time.time()
+    previous_profiles, previous_unions = read_tables(path)
+    if priorities:
+        priorities.learn_tables(previous_profiles, previous_unions)
+    stale_ids = []
+    stale_urls = set()
+    for doc_id, profile in previous_profiles.items():
+        if is_stale(profile, now, args.max_age, args.living_max_age):
+            stale_ids.append(profile['id'])
+            stale_urls.add(profile['url'])
         else:
-            for endpoint in handle_union(response, profiles, unions, lock):
-                q.put(endpoint)
-        q.task_done()
+            profiles.insert(doc_id, profile)
+    for doc_id, union in previous_unions.items():
+        if not stale_urls.intersection(union.get('partners', [])):
+            unions.insert(doc_id, union)
+    logging.info(f'Copied {len(profiles)} fresh profiles and {len(unions)} '
+        f'unions from {path}; {len(stale_ids)} profiles are stale')
+    if not profiles.contains(int(seed.split('-')[1])) \
+            and seed not in stale_ids:
+        stale_ids.insert(0, seed)
+    # Links to documents missing from the previous database would otherwise 
+    # only be followed once the document linking them is stale
+    missing = {'profile': set(), 'union': set()}
+    for doc_id, union in previous_unions.items():
+        if not unions.contains(doc_id):
+            continue
+        for c in union.get('children', []):
+            geni_id = c.split('/')[-1]
+            if not profiles.contains(int(geni_id.split('-')[1])):
+                missing['profile'].add(geni_id)
+    for doc_id, profile in previous_profiles.items():
+        if not profiles.contains(doc_id):
+            continue
+        for u in profile.get('unions', []):
+            geni_id = u.split('/')[-1]
+            if not unions.contains(int(geni_id.split('-')[1])):
+                missing['union'].add(geni_id)
+    missing['profile'].difference_update(stale_ids)
+    if any(missing.values()):
+        logging.info(f'Requesting {len(missing["profile"])} profiles and '
+            f'{len(missing["union"])} unions missing from {path}')
+    return {'profile': stale_ids + sorted(missing['profile']), 
+        'union': sorted(missing['union'])}
 
+@lru_cache(maxsize=None)
 def geni_id_to_uuid(geni_id):
     return str(uuid5(NAMESPACE_X500, str(geni_id)))
 
@@ -226,114 +872,376 @@ def profile_to_row(profile, parent_profile=None):
         '_geni_deleted': profile.get('deleted'),
     }
 
-def db_to_rows(profiles, unions):
-    '''Take the Geni (local) database and translate it into the simplified row 
-    format expected by the main script.
+def index_union(union):
+    '''Index entry of a union: the partner urls, child urls and adopted/foster 
+    child urls as sets, along with the ids of the partners and (natural) 
+    children, so that they are only computed once.
     '''
-    rows = []
-    len_profiles = len(profiles)
-    for i, profile in enumerate(profiles):
-        # Log progress
-        if not (i+1) % 100:
-            logging.info(f'Processing {i+1}/{len_profiles}')
-        # Skip private profiles
-        if not profile.get('public'):
+    partners = union.get('partners', [])
+    children = union.get('children', [])
+    excluded = set(union.get('adopted_children', [])) \
+        | set(union.get('foster_children', []))
+    return (
+        set(partners), 
+        set(children), 
+        excluded, 
+        [geni_id_to_uuid(p.split('/')[-1]) for p in partners],
+        [geni_id_to_uuid(c.split('/')[-1]) for c in children 
+            if c not in excluded],
+    )
+
+def index_unions(unions):
+    '''Index the unions by numeric Geni id (see index_union).
+    '''
+    return {int(union['id'].split('-')[1]): index_union(union) 
+        for union in unions}
+
+def union_links(geni_url, union):
+    '''Children and parents of a profile (by url) through an indexed union.
+    '''
+    partners, children, excluded, partner_ids, child_ids = union
+    # If a partner in the union, get children
+    if geni_url in partners:
+        return child_ids, []
+    # If a child in the union, get parents
+    elif geni_url in children and geni_url not in excluded:
+        return [], partner_ids
+    return [], []
+
+def simple_row(profile):
+    '''Translate a profile into the simplified row format without its 
+    children and parents, or None if the profile is private.
+    '''
+    # Skip private profiles
+    if not profile.get('public'):
+        return None
+    # Get id information
+    _geni_id = profile['id']
+    _id = geni_id_to_uuid(_geni_id)
+    name = profile.get('name')
+    # Determine birth/death dates
+    _birth_date = profile.get('birth', {}).get('date', {})
+    _death_date = profile.get('death', {}).get('date', {})
+    birth_date, birth_accuracy = parse_date(_birth_date)
+    death_date, death_accuracy = parse_date(_death_date)
+    return {
+        '_id': _id,
+        'name': name,
+        'short_name': profile.get('display_name', name),
+        'gender': profile.get('gender'),
+        'birth_date': birth_date and birth_date.isoformat(),
+        'birth_accuracy': birth_accuracy,
+        'death_date': death_date and death_date.isoformat(),
+        'death_accuracy': death_accuracy,
+        'is_alive': profile.get('is_alive'),
+        'children_ids': [],
+        'parent_ids': [],
+        'external_url': profile.get('profile_url'),
+        '_geni_id': _geni_id,
+    }
+
+def profile_to_simple_row(profile, union_index):
+    '''Translate a profile into the simplified row format, or None if the 
+    profile is private.
+    '''
+    row = simple_row(profile)
+    if row is None:
+        return None
+    # Find children and parents through unions.
+    # NOTE: The ids of children/parents may not be present in rows.
+    for geni_union_url in profile.get('unions', []):
+        _doc_id = int(geni_union_url.split('-')[1])
+        union = union_index.get(_doc_id)
+        if union is None:
+            logging.warning(f'Union {_doc_id} of {profile["id"]} not in '
+                'database')
             continue
-        # Get id information
-        _geni_id = profile['id']
-        _geni_url = profile['url']
-        _id = geni_id_to_uuid(_geni_id)
-        name = profile.get('name')
-        # Determine birth/death dates
-        _birth_date = profile.get('birth', {}).get('date', {})
-        _death_date = profile.get('death', {}).get('date', {})
-        birth_date, birth_accuracy = parse_date(_birth_date)
-        death_date, death_accuracy = parse_date(_death_date)
-        # Find children and parents through unions.
-        # NOTE: The ids of children/parents may not be present in rows.
-        children_ids = []
-        parent_ids = []
-        for geni_union_url in profile.get('unions', []):
+        children_ids, parent_ids = union_links(profile['url'], union)
+        row['children_ids'].extend(children_ids)
+        row['parent_ids'].extend(parent_ids)
+    return row
+
+class RowBuilder(object):
+    '''Builds the simplified rows (as db_to_rows) in a background thread as 
+    the profiles and unions are stored, so that the conversion overlaps with 
+    the crawl, which mostly waits on the rate limit. A row holds a slot for 
+    the links (children and parents) through each of the profile's unions, 
+    which is filled when the union arrives.
+    '''
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._union_index = {}
+        # Row, union slots and url of each (public) profile
+        self._rows = {}
+        # Slots waiting on each union not yet arrived
+        self._waiting = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def follow(self, store):
+        '''Add the documents already in the store, and those inserted later.
+        '''
+        for union in store.unions:
+            self.add_union(union)
+        for profile in store.profiles:
+            self.add_profile(profile)
+        store.unions.on_insert = self.add_union
+        store.profiles.on_insert = self.add_profile
+
+    def add_profile(self, profile):
+        self._queue.put(('profile', profile))
+
+    def add_union(self, union):
+        self._queue.put(('union', union))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            kind, document = item
+            if kind == 'profile':
+                self._add_profile(document)
+            else:
+                self._add_union(document)
+
+    def _add_profile(self, profile):
+        row = simple_row(profile)
+        if row is None:
+            return
+        doc_id = int(profile['id'].split('-')[1])
+        slots = []
+        for i, geni_union_url in enumerate(profile.get('unions', [])):
             _doc_id = int(geni_union_url.split('-')[1])
-            union = unions.get(doc_id=_doc_id)
-            # If a partner in the union, get children
-            if _geni_url in union.get('partners', []):
-                for child_url in union.get('children', []):
-                    is_adopted = child_url in union.get('adopted_children', [])
-                    is_foster = child_url in union.get('foster_children', [])
-                    if is_adopted or is_foster:
-                        continue
-                    child_id = child_url.split('/')[-1]
-                    children_ids.append(geni_id_to_uuid(child_id))
-            # If a child in the union, get parents
-            elif _geni_url in union.get('children', []):
-                is_adopted = _geni_url in union.get('adopted_children', [])
-                is_foster = _geni_url in union.get('foster_children', [])
-                if is_adopted or is_foster:
+            union = self._union_index.get(_doc_id)
+            if union is None:
+                self._waiting.setdefault(_doc_id, []).append((doc_id, i))
+                slots.append(None)
+            else:
+                slots.append(union_links(profile['url'], union))
+        self._rows[doc_id] = (row, slots, profile['url'], 
+            profile.get('unions', []))
+
+    def _add_union(self, union):
+        doc_id = int(union['id'].split('-')[1])
+        self._union_index[doc_id] = entry = index_union(union)
+        for profile_doc_id, i in self._waiting.pop(doc_id, []):
+            _, slots, geni_url, _ = self._rows[profile_doc_id]
+            slots[i] = union_links(geni_url, entry)
+
+    def finish(self):
+        '''Wait for the documents added so far, and return the rows in Geni id 
+        order.
+        '''
+        self._queue.put(None)
+        self._thread.join()
+        rows = []
+        for doc_id in sorted(self._rows):
+            row, slots, _, union_urls = self._rows[doc_id]
+            for geni_union_url, slot in zip(union_urls, slots):
+                if slot is None:
+                    _doc_id = int(geni_union_url.split('-')[1])
+                    logging.warning(f'Union {_doc_id} of {row["_geni_id"]} '
+                        'not in database')
                     continue
-                for partner_url in union.get('partners', []):
-                    partner_id = partner_url.split('/')[-1]
-                    parent_ids.append(geni_id_to_uuid(partner_id))
-        row = {
-            '_id': _id,
-            'name': name,
-            'short_name': profile.get('display_name', name),
-            'gender': profile.get('gender'),
-            'birth_date': birth_date and birth_date.isoformat(),
-            'birth_accuracy': birth_accuracy,
-            'death_date': death_date and death_date.isoformat(),
-            'death_accuracy': death_accuracy,
-            'is_alive': profile.get('is_alive'),
-            'children_ids': children_ids,
-            'parent_ids': parent_ids,
-            'external_url': profile.get('profile_url'),
-            '_geni_id': _geni_id,
-        }
-        rows.append(row)
+                children_ids, parent_ids = slot
+                row['children_ids'].extend(children_ids)
+                row['parent_ids'].extend(parent_ids)
+            rows.append(row)
+        logging.info(f'Built {len(rows)} rows during the crawl')
+        return rows
+
+# Union index of the conversion worker processes
+_union_index = None
+
+def _init_worker(union_index):
+    global _union_index
+    _union_index = union_index
+
+def _profiles_to_rows(profiles):
+    return [profile_to_simple_row(p, _union_index) for p in profiles]
+
+def db_to_rows(profiles, unions, processes=1, chunk_size=2000):
+    '''Take the Geni (local) database and translate it into the simplified row 
+    format expected by the main script. The unions are indexed first, and the 
+    profiles are optionally converted in chunks over a process pool.
+    '''
+    start = time.perf_counter()
+    union_index = index_unions(unions)
+    profiles = list(profiles)
+    logging.info(f'Indexed {len(union_index)} unions in '
+        f'{time.perf_counter() - start:.2f} seconds')
+    chunks = [profiles[i:i+chunk_size] 
+        for i in range(0, len(profiles), chunk_size)]
+    rows = []
+    if processes > 1:
+        with multiprocessing.Pool(processes, initializer=_init_worker, 
+                initargs=(union_index,)) as pool:
+            for chunk_rows in pool.imap(_profiles_to_rows, chunks):
+                rows.extend(chunk_rows)
+                logging.info(f'Processed {len(rows)}/{len(profiles)}')
+    else:
+        for chunk in chunks:
+            rows.extend(profile_to_simple_row(p, union_index) for p in chunk)
+            logging.info(f'Processed {len(rows)}/{len(profiles)}')
+    rows = [row for row in rows if row is not None]
+    elapsed = time.perf_counter() - start
+    logging.info(f'Converted {len(profiles)} profiles to {len(rows)} rows in '
+        f'{elapsed:.2f} seconds ({len(profiles) / (elapsed or 1):.0f}/s)')
     return rows
 
 def main(args):
+    global BASE
+    if args.base_url:
+        BASE = args.base_url.rstrip('/')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    metrics.publish(args.metrics_file, args.metrics_port, 
+        args.metrics_interval)
     # Instance the local database
-    storage = CachingMiddleware(JSONStorage)
-    db = TinyDB(args.db, storage=storage, sort_keys=True, indent=2)
-    # db = TinyDB(storage=MemoryStorage)
-    profiles = db.table('profiles')
-    unions = db.table('unions')
-    lock = threading.Lock()
-    # Instance a shared requests session to improve efficiency
-    session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(
-        pool_connections=args.workers, pool_maxsize=args.workers)
-    session.mount('https://', adapter)
-    # Instance the task queue
-    q = queue.Queue()
-    # Start the workers
-    for _ in range(args.workers):
-        _args = (q, session, profiles, unions, lock)
-        threading.Thread(target=worker, args=_args, daemon=True).start()
-    # Start the work and wait until queue is empty
-    endpoint = f'{BASE}/profile?ids={args.seed}'
-    q.put(endpoint)
-    # Wait until all tasks off queue
-    q.join()
-    # Flush the database cache to storage
-    db.storage.flush()
-    db.close()
+    store = Store(args.db)
+    # Build the rows as documents are stored, unless converting with a pool
+    builder = None
+    if args.processes <= 1:
+        builder = RowBuilder()
+        builder.follow(store)
+    limiter = TokenBucket(RATE_LIMIT, RATE_WINDOW)
+    # Request the ids closest to the top of the line first, so that a 
+    # budgeted run refreshes the most important profiles
+    positions = load_positions(args.previous_successors) \
+        if args.previous_successors else None
+    priorities = Priorities(args.seed, positions)
+    scheduler = Scheduler(store, limiter, priorities, args.max_requests, 
+        args.deadline and args.deadline * 60)
+    # Determine the starting work
+    if args.resume:
+        if args.previous:
+            priorities.learn_tables(*read_tables(args.previous))
+        priorities.learn_tables(store.profiles, store.unions)
+        pending = store.pending()
+        logging.info(f'Resuming with {len(pending)} pending ids')
+        for kind, geni_id in pending:
+            scheduler.add(kind, [geni_id])
+    else:
+        # The copy from the previous database and the starting ids are 
+        # committed together, so that a run killed while seeding is not 
+        # mistaken for a finished one by --resume
+        with store.transaction():
+            cleared = store.clear_pending()
+            if cleared:
+                logging.warning(f'Discarded {cleared} pending ids from an '
+                    'unfinished run (use --resume to continue it)')
+            if args.previous:
+                seeds = seed_from_previous(args.previous, store.profiles, 
+                    store.unions, args.seed, args, priorities)
+            else:
+                seeds = {'profile': [args.seed]}
+            for kind, geni_ids in seeds.items():
+                store.push(kind, scheduler.add(kind, geni_ids))
+    with metrics.stage('crawl'):
+        if args.engine == 'async':
+            asyncio.run(crawl_async(store, scheduler))
+        else:
+            # Instance a shared requests session to improve efficiency
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=args.workers, pool_maxsize=args.workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            # Start the workers and wait until the scheduler is finished
+            threads = [threading.Thread(target=worker, 
+                args=(session, store, scheduler), daemon=True) 
+                for _ in range(args.workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    logging.info(f'Made {scheduler.requests} requests with a batch fill ratio '
+        f'of {scheduler.fill_ratio():.0%}; avoided {scheduler.duplicates} '
+        'duplicate ids')
+    store.commit()
+    pending = store.pending()
+    if pending:
+        # The ids not yet requested (or whose requests failed) remain pending 
+        # in the store, and the partial crawl must not replace a complete one
+        reason = 'the request budget or deadline' if scheduler.exhausted() \
+            else 'failed requests'
+        logging.warning(f'Stopped with {len(pending)} ids pending after '
+            f'{reason}; use --resume to continue')
+        store.close()
+        metrics.close()
+        sys.exit(1)
     logging.info('Geni requests done!')
-    # Now do the conversion
-    logging.info('Processing database into simplified row format...')
-    rows = db_to_rows(profiles, unions)
-    logging.info(f'Dumping {len(rows)} rows to file...')
-    with open('geni.yml', 'w+') as f:
-        yaml.dump(rows, f, indent=2, sort_keys=True)
+    # Now finish the conversion
+    with metrics.stage('convert'):
+        if builder:
+            rows = builder.finish()
+        else:
+            logging.info('Processing database into simplified row format...')
+            rows = db_to_rows(store.profiles, store.unions, args.processes)
+    store.close()
+    with metrics.stage('output'):
+        if args.output:
+            logging.info(f'Dumping {len(rows)} rows to {args.output}...')
+            with open(args.output, 'w+') as f:
+                yaml.dump(rows, f, indent=2, sort_keys=True)
+        if args.columns:
+            logging.info(f'Writing {len(rows)} rows to {args.columns}...')
+            write_columns(rows, args.columns)
+    metrics.close()
 
-if __name__ == '__main__':
+def parse_arguments(argv=None):
+    '''Parse the command line arguments (or the given list of arguments).
+    '''
     parser = argparse.ArgumentParser()
     parser.add_argument('--seed', type=str, default='profile-56847813',
         help='Seed for finding descendants (default is Sophia of Hanover.')
     parser.add_argument('--workers', type=int, default=1, 
         help='Number of workers to make threaded requests.')
-    parser.add_argument('--db', type=str, default='db.json',
-        help='Local database of raw Geni responses.')
-    args = parser.parse_args()
-    main(args)
+    parser.add_argument('--engine', type=str, default='threads',
+        choices=['threads', 'async'],
+        help='Make requests from worker threads, or from a single thread '
+            'with asyncio (requires aiohttp).')
+    parser.add_argument('--base-url', type=str, default=None,
+        help=f'Base url of the Geni API (default {BASE}), e.g. to use the '
+            'simulator in geni_sim.py.')
+    parser.add_argument('--db', type=str, default='geni.db',
+        help='Local SQLite database of raw Geni responses.')
+    parser.add_argument('--output', type=str, default='geni.yml',
+        help='YAML file for the simplified rows (empty to skip).')
+    parser.add_argument('--columns', type=str, default=None,
+        help='Directory for the simplified rows in columnar format, which '
+            'main.py loads much faster than YAML.')
+    parser.add_argument('--processes', type=int, default=1,
+        help='Number of processes for the conversion to simplified rows '
+            'after the crawl. By default rows are built during the crawl.')
+    parser.add_argument('--resume', action='store_true',
+        help='Resume an unfinished run from the pending endpoints in the '
+            'local database.')
+    parser.add_argument('--previous', type=str, default=None,
+        help='Previous database (or legacy TinyDB JSON file) to '
+            'incrementally update from. Only stale '
+            'profiles (and the new unions/children found from them) are '
+            'requested.')
+    parser.add_argument('--previous-successors', type=str, default=None,
+        help='Previous successors JSON file written by main.py. Profiles '
+            'higher in the current line are requested first.')
+    parser.add_argument('--max-requests', type=int, default=None,
+        help='Stop after this many requests, leaving the rest pending for '
+            '--resume.')
+    parser.add_argument('--deadline', type=float, default=None,
+        help='Stop making requests after this many minutes, leaving the '
+            'rest pending for --resume.')
+    parser.add_argument('--max-age', type=float, default=90,
+        help='Maximum age in days of a previously fetched profile before it '
+            'is requested again (default 90).')
+    parser.add_argument('--living-max-age', type=float, default=0,
+        help='Maximum age in days of a previously fetched living profile '
+            'before it is requested again (default 0, i.e. always).')
+    parser.add_argument('--verbose', action='store_true',
+        help='Log every request and stored document.')
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,324 @@
+'''Local stand-in for the Geni API, for developing and benchmarking geni.py
+without using the real quota. Serves /api/profile?ids= and /api/union?ids=
+from the profiles and unions recorded by a previous crawl (geni.db, or a
+legacy TinyDB db.json), or from a synthetic tree. The rate limit is enforced
+with the Geni rate limit headers, and latency, 429 and 5xx responses can be
+simulated. Request statistics are served from /api/stats.
+
+Point geni.py at it with --base-url, e.g.
+
+    python geni_sim.py --synthetic 5000 --port 8001
+    python geni.py --seed profile-1 --base-url http://127.0.0.1:8001/api
+'''
+
+import argparse
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from geni import read_tables
+
+logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+# Base url of the simulated documents
+URL = 'https://www.geni.com/api'
+
+def synthetic_tree(size, seed=0):
+    '''Profiles and unions (in the Geni response format, keyed by numeric id)
+    of a synthetic family tree of about size profiles descending from
+    profile-1 and its siblings. Partners married into the family are not
+    included, as the crawler does not request them.
+    '''
+    rng = random.Random(seed)
+    profiles, unions = {}, {}
+    now = int(time.time())
+
+    def new_profile(year):
+        doc_id = len(profiles) + 1
+        gender = rng.choice(['male', 'female'])
+        profile = {
+            'id': f'profile-{doc_id}',
+            'guid': str(6000000000000000000 + doc_id),
+            'url': f'{URL}/profile-{doc_id}',
+            'profile_url': f'https://www.geni.com/people/P{doc_id}/'
+                f'{6000000000000000000 + doc_id}',
+            'name': f'Person {doc_id}',
+            'display_name': f'Person {doc_id}',
+            'first_name': 'Person',
+            'last_name': str(doc_id),
+            'gender': gender,
+            'public': rng.random() > 0.02,
+            'created_at': str(now - rng.randrange(15 * 365 * 86400)),
+            'updated_at': str(now - rng.randrange(5 * 365 * 86400)),
+            'unions': [],
+        }
+        # Dates are less precise further back
+        accuracy = rng.random() * (2020 - year) / 400
+        birth = {'year': year}
+        if accuracy < 0.8:
+            birth['month'] = rng.randint(1, 12)
+        if accuracy < 0.6:
+            birth['day'] = rng.randint(1, 28)
+        profile['birth'] = {'date': birth}
+        age = rng.choice([0, 2, 30, 60, 75, 85, 95])
+        if year + age < 2020:
+            profile['death'] = {'date': {'year': year + age}}
+            profile['is_alive'] = False
+        else:
+            profile['is_alive'] = True
+        profile['living'] = profile['is_alive']
+        profiles[doc_id] = profile
+        return profile
+
+    def new_union(partners, children, adopted=()):
+        doc_id = len(unions) + 1
+        url = f'{URL}/union-{doc_id}'
+        unions[doc_id] = union = {
+            'id': f'union-{doc_id}',
+            'url': url,
+            'partners': partners,
+            'children': children + list(adopted),
+        }
+        if adopted:
+            union['adopted_children'] = list(adopted)
+        return url
+
+    # The seed and siblings share the union of their parents
+    siblings = [new_profile(1630 + 2 * i) for i in range(rng.randint(2, 5))]
+    parents_url = new_union([f'{URL}/profile-0'],
+        [s['url'] for s in siblings])
+    for sibling in siblings:
+        sibling['unions'].append(parents_url)
+    frontier = deque(siblings)
+    while frontier and len(profiles) < size:
+        parent = frontier.popleft()
+        year = parent['birth']['date']['year']
+        if year > 2000 or 'death' in parent and \
+                parent['death']['date']['year'] - year < 16:
+            continue
+        # Occasionally remarried, with children in each union
+        for marriage in range(1 if rng.random() > 0.1 else 2):
+            count = min(rng.choice([0, 0, 1, 2, 2, 3, 3, 4, 5, 7]),
+                size - len(profiles))
+            children = [new_profile(year + 22 + 8 * marriage + 2 * i)
+                for i in range(count)]
+            adopted = [new_profile(year + 25)] \
+                if children and rng.random() < 0.02 else []
+            spouse = f'{URL}/profile-{10 ** 12 + len(unions)}'
+            url = new_union([parent['url'], spouse],
+                [c['url'] for c in children],
+                [a['url'] for a in adopted])
+            parent['unions'].append(url)
+            for child in children + adopted:
+                child['unions'].append(url)
+            frontier.extend(children)
+    return profiles, unions
+
+class SimulatedGeni(object):
+    '''The simulated API: documents, rate limit, faults and statistics.
+    Requests over the limit of a sliding window get a 429 response.
+    '''
+    def __init__(self, profiles, unions, limit=10, window=10, latency=0.2,
+            error_rate=0, throttle_rate=0, seed=None):
+        self.tables = {'profile': profiles, 'union': unions}
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._accepted = deque()
+            self._served = {'profile': Counter(), 'union': Counter()}
+            self.status = Counter()
+            self.first = self.last = None
+
+    def _admit(self, now):
+        '''Returns the status of a request arriving now (before faults), and
+        the rate limit headers.
+        '''
+        while self._accepted and self._accepted[0] <= now - self.window:
+            self._accepted.popleft()
+        if len(self._accepted) >= self.limit:
+            retry_after = self._accepted[0] + self.window - now
+            return 429, {'Retry-After': f'{retry_after:.2f}',
+                'X-API-Rate-Remaining': '0'}
+        self._accepted.append(now)
+        return 200, {'X-API-Rate-Remaining':
+            str(self.limit - len(self._accepted))}
+
+    def respond(self, kind, geni_ids):
+        '''Response to a request for ids, as (status, headers, data, delay)
+        where delay is the simulated latency.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            self.first = self.first or now
+            self.last = now
+            status, headers = self._admit(now)
+            fault = self._random.random()
+            if status == 200 and fault < self.throttle_rate:
+                status = 429
+            elif status == 200 and fault < self.throttle_rate \
+                    + self.error_rate:
+                status = self._random.choice([500, 502, 503])
+            self.status[status] += 1
+            delay = self.latency * self._random.uniform(0.5, 1.5)
+            if status != 200:
+                return status, headers, None, delay
+            served = self._served[kind]
+            served.update(geni_ids)
+        headers['X-API-Rate-Limit'] = str(self.limit)
+        headers['X-API-Rate-Window'] = str(self.window)
+        results = []
+        for geni_id in geni_ids:
+            document = self.tables[kind].get(int(geni_id.split('-')[1]))
+            if document is not None:
+                # Drop the fields added by geni.py
+                results.append({k: v for k, v in document.items()
+                    if not k.startswith('_')})
+        data = results[0] if len(results) == 1 else {'results': results}
+        return status, headers, data, delay
+
+    def stats(self):
+        '''Statistics since the last reset. Idle quota is the proportion of
+        the rate limit left unused between the first and last requests.
+        '''
+        with self._lock:
+            span = (self.last - self.first) if self.first else 0
+            accepted = sum(n for status, n in self.status.items()
+                if status != 429)
+            quota = span * self.limit / self.window
+            return {
+                'requests': sum(self.status.values()),
+                'status': {str(k): v for k, v in sorted(self.status.items())},
+                'ids': {kind: sum(served.values())
+                    for kind, served in self._served.items()},
+                'duplicate_ids': {kind: sum(n - 1 for n in served.values())
+                    for kind, served in self._served.items()},
+                'span': span,
+                'idle_quota': max(0, 1 - accepted / quota) if quota else 0,
+            }
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        # Crawlers exit without closing their keep-alive connections
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        if path == '/api/stats':
+            return self.send_json(200, {}, self.server.geni.stats())
+        kind = path[len('/api/'):]
+        if not path.startswith('/api/') or kind not in ('profile', 'union') \
+                or 'ids' not in query:
+            return self.send_json(404, {}, {'error': 'Not found'})
+        status, headers, data, delay = self.server.geni.respond(kind,
+            query['ids'][-1].split(','))
+        time.sleep(delay)
+        self.send_json(status, headers,
+            data if status == 200 else {'error': f'Status {status}'})
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip('/') == '/api/reset':
+            self.server.geni.reset()
+            return self.send_json(200, {}, {})
+        self.send_json(404, {}, {'error': 'Not found'})
+
+    def send_json(self, status, headers, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def serve(geni, host='127.0.0.1', port=0):
+    '''Serve the simulated API from a background thread. Returns the server,
+    whose base url is f'http://{host}:{server.server_port}/api'.
+    '''
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.geni = geni
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_arguments(parser):
+    '''Arguments for the simulated API, shared with the crawl benchmark.
+    '''
+    parser.add_argument('--db', type=str, default=None,
+        help='Database of a previous crawl (or legacy TinyDB JSON file) to '
+            'serve.')
+    parser.add_argument('--synthetic', type=int, default=2000,
+        help='Number of profiles in the synthetic tree to serve if no '
+            'database is given (the seed is profile-1).')
+    parser.add_argument('--limit', type=int, default=10,
+        help='Requests allowed per rate limit window.')
+    parser.add_argument('--window', type=int, default=10,
+        help='Rate limit window in seconds.')
+    parser.add_argument('--latency', type=float, default=0.2,
+        help='Mean response latency in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0,
+        help='Probability of a 5xx response.')
+    parser.add_argument('--throttle-rate', type=float, default=0,
+        help='Probability of a 429 response within the rate limit.')
+    parser.add_argument('--random-seed', type=int, default=0,
+        help='Random seed for the synthetic tree and faults.')
+
+def from_arguments(args):
+    if args.db:
+        profiles, unions = read_tables(args.db)
+    else:
+        profiles, unions = synthetic_tree(args.synthetic, args.random_seed)
+    logging.info(f'Serving {len(profiles)} profiles and {len(unions)} unions')
+    return SimulatedGeni(profiles, unions, args.limit, args.window,
+        args.latency, args.error_rate, args.throttle_rate, args.random_seed)
+
+def main():
+
+    # Define and parse arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+        help='Host to listen on.')
+    parser.add_argument('--port', type=int, default=8001,
+        help='Port to listen on.')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.geni = from_arguments(args)
+    logging.info(f'Serving on http://{args.host}:{args.port}/api')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
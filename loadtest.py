@@ -0,0 +1,131 @@
+'''Load test for server.py. Requests a mix of lines at random dates, rank
+histories of random successors and changes between random dates from a
+number of concurrent clients, and reports the latency percentiles and
+requests per second of each kind.
+'''
+
+import argparse
+from collections import defaultdict
+from datetime import date, timedelta
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import quote, urlparse
+
+logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+def random_date(rng, start, end):
+    return (start + timedelta(days=rng.randrange((end - start).days))) \
+        .isoformat()
+
+def make_paths(rng, ids, count, start, end, top):
+    '''Random request paths, mostly lines (of popular dates) with some
+    histories and changes.
+    '''
+    popular = [random_date(rng, start, end) for _ in range(20)]
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            paths.append(('line', f'/line?date={rng.choice(popular)}'
+                f'&top={top}'))
+        elif kind < 0.7:
+            paths.append(('line', f'/line?date='
+                f'{random_date(rng, start, end)}&top={top}'))
+        elif kind < 0.9:
+            paths.append(('history',
+                f'/person/{quote(rng.choice(ids))}/history'))
+        else:
+            # Steps of a date slider
+            a = date.fromisoformat(random_date(rng, start, end))
+            b = a + timedelta(days=rng.randrange(5 * 365))
+            paths.append(('changes', f'/changes?from={a}&to={b}'))
+    return paths
+
+def client(host, port, paths, results, gzip):
+    '''Make the requests over one keep-alive connection, recording the
+    latency of each.
+    '''
+    connection = http.client.HTTPConnection(host, port)
+    headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+    for kind, path in paths:
+        start = time.perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        results.append((kind, response.status, time.perf_counter() - start))
+    connection.close()
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def report(name, results, elapsed):
+    latencies = [latency for _, _, latency in results]
+    errors = sum(1 for _, status, _ in results if status != 200)
+    logging.info(f'{name:>8}: {len(results):6d} requests, {errors} errors, '
+        f'p50 {1000 * percentile(latencies, 0.5):7.2f} ms, '
+        f'p99 {1000 * percentile(latencies, 0.99):7.2f} ms, '
+        f'{len(results) / elapsed:8.0f}/s')
+
+def main():
+
+    # Define and parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000',
+        help='Base url of the server.')
+    parser.add_argument('--requests', type=int, default=5000,
+        help='Total number of requests.')
+    parser.add_argument('--concurrency', type=int, default=8,
+        help='Number of concurrent clients.')
+    parser.add_argument('--top', type=int, default=100,
+        help='Top of the line to request.')
+    parser.add_argument('--start', type=str, default='1700-01-01',
+        help='Earliest date to request.')
+    parser.add_argument('--end', type=str, default=date.today().isoformat(),
+        help='Latest date to request.')
+    parser.add_argument('--no-gzip', action='store_true',
+        help='Do not accept gzipped responses.')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Random seed for the requests.')
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    rng = random.Random(args.seed)
+    # Pick successors for the histories from the current line
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    connection.request('GET', '/line')
+    line = json.load(connection.getresponse())
+    ids = [successor['_id'] for successor in line['successors']]
+    connection.close()
+    start, end = date.fromisoformat(args.start), date.fromisoformat(args.end)
+    paths = make_paths(rng, ids, args.requests, start, end, args.top)
+
+    # Split the requests between the clients
+    results = [[] for _ in range(args.concurrency)]
+    threads = [threading.Thread(target=client, args=(url.hostname, url.port,
+        paths[i::args.concurrency], results[i], not args.no_gzip))
+        for i in range(args.concurrency)]
+    logging.info(f'Making {len(paths)} requests from {args.concurrency} '
+        'clients...')
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = [result for client_results in results
+        for result in client_results]
+    by_kind = defaultdict(list)
+    for result in results:
+        by_kind[result[0]].append(result)
+    for kind, kind_results in sorted(by_kind.items()):
+        report(kind, kind_results, elapsed)
+    report('all', results, elapsed)
+
+if __name__ == '__main__':
+    main()
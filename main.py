@@ -3,31 +3,157 @@
 import argparse
 from datetime import datetime, timedelta
 from dateutil.parser import parse as parse_date
+from functools import lru_cache
+import itertools
 import json
 import pandas as pd
 import logging
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import time
 import yaml
 
+from columns import read_columns
+import metrics
+
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
 
 # Perth agreement dates
 PERTH_SIGNED = '2011-10-28'
 PERTH_EFFECTED = '2015-03-26'
+# Integer days for dates which never come
+NEVER = np.iinfo(np.int64).max
+# Columns of the successors output
+OUTPUT_COLUMNS = ['name', 'birth_date', 'death_date', 'illegitimate_date', 
+    'legitimate_date', 'external_url']
 
-def set_illegitimate(df, key, value, date=None):
-    try:
-        cond = (df[key] == value)
-    except KeyError:
-        return
-    if sum(cond) > 0:
-        filtered = df[cond]
-        for index, row in filtered.iterrows():
-            illegitimate_date = date or row['birth_date']
-            df.loc[index, 'illegitimate_date'] = illegitimate_date
-            logging.debug(f'Marked {row["short_name"]} illegitimate '
-                f'from {illegitimate_date}')
+def load_descendants(path):
+    '''Load the descendants dataframe (indexed by _id) from a YAML file or a 
+    columnar directory written by geni.py.
+    '''
+    if not os.path.isdir(path):
+        with open(path, 'r') as f:
+            rows = yaml.safe_load(f)
+        return pd.DataFrame(rows).set_index('_id')
+    meta, ids, columns = read_columns(path)
+    n = meta['rows']
+    all_ids = np.asarray(ids).astype(object)
+    data = {}
+    for key, kind in meta['columns'].items():
+        if kind == 'ids':
+            # Slice the lists out of one flat list of ids, rather than 
+            # indexing the (memory mapped) arrays for each row
+            indptr, indices = columns[key]
+            flat = all_ids[indices].tolist()
+            bounds = indptr.tolist()
+            data[key] = [flat[bounds[j]:bounds[j+1]] for j in range(n)]
+        elif kind == 'bool':
+            values = columns[key]
+            data[key] = pd.Series(values == 1, dtype=object)
+            data[key][values == -1] = None
+        else:
+            values, isnull = columns[key]
+            data[key] = pd.Series(values.tolist(), dtype=object)
+            data[key][isnull] = None
+    df = pd.DataFrame(data)
+    df.index = pd.Index(all_ids[:n], name='_id')
+    return df
+
+def load_children(path):
+    '''The child adjacency of a columnar directory written by geni.py, as 
+    (ids, indptr, indices) arrays for SuccessionGraph, or None for a YAML 
+    file (whose children_ids lists are used instead).
+    '''
+    if not os.path.isdir(path):
+        return None
+    meta, ids, columns = read_columns(path)
+    indptr, indices = columns['children_ids']
+    return pd.Index(np.asarray(ids).astype(object)), np.asarray(indptr), \
+        np.asarray(indices)
+
+def load_illegitimates(path):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or []
+
+def clean_descendants(df):
+    '''Delete descendants without a birth date, dead without a death date, or 
+    with impossible birth/death dates.
+    '''
+    logging.info(f'Cleaning total of {len(df)} descendants...')
+    # Delete null birth dates
+    cond = df['birth_date'].isnull()
+    logging.info(f'Deleting {sum(cond)} descendants without birth date...')
+    df = df[~cond]
+    # Delete null death dates
+    cond = df['death_date'].isnull() & ~df['is_alive'].isnull() \
+        & (df['is_alive'] == False)
+    logging.info(f'Deleting {sum(cond)} dead descendants without death date...')
+    df = df[~cond]
+    # Delete anyone with birth later than death
+    cond = df['death_date'].notnull() & (df['death_date'] < df['birth_date'])
+    logging.info(f'Deleting {sum(cond)} impossible birth/death dates...')
+    df = df[~cond]
+    # All done
+    total = len(df)
+    logging.info(f'Done cleaning! Total of {total} descendants remain')
+    return df
+
+def index_column(df, key):
+    '''Hash index of the (non-null) values of a column to row positions.
+    '''
+    index = {}
+    for position, value in enumerate(df[key].tolist()):
+        if pd.notnull(value):
+            index.setdefault(value, []).append(position)
+    return index
+
+def apply_illegitimates(df, illegitimates):
+    '''Set the illegitimate_date column from the rules in illegitimates.yml. 
+    Each match key is indexed once, and a person matching any key/value pair 
+    of a rule is tagged with its date (or their birth date if null). Where 
+    several rules match a person the later rule in the file takes effect. 
+    Rules matching nobody or more than one person are reported.
+    '''
+    keys = sorted(set(key for rule in illegitimates for key in rule['match']))
+    indexes = {key: index_column(df, key) for key in keys if key in df}
+    missing = [key for key in keys if key not in indexes]
+    if missing:
+        logging.info(f'Descendants have no {", ".join(missing)} column; '
+            'rules can not match on these keys')
+    rules = np.full(len(df), -1)
+    for i, rule in enumerate(illegitimates):
+        positions = sorted(set(position 
+            for key, value in rule['match'].items()
+            for position in indexes.get(key, {}).get(value, [])))
+        if not positions:
+            logging.warning(f'Illegitimate rule {i} {rule["match"]} matched '
+                'nobody')
+        elif len(positions) > 1:
+            logging.warning(f'Illegitimate rule {i} {rule["match"]} matched '
+                f'{len(positions)} persons: {df.index[positions].tolist()}')
+        overridden = rules[positions] >= 0
+        if overridden.any():
+            logging.debug(f'Illegitimate rule {i} overrides rules '
+                f'{rules[positions][overridden].tolist()}')
+        rules[positions] = i
+    matched = np.flatnonzero(rules >= 0)
+    dates = pd.Series([rule.get('date') for rule in illegitimates], 
+        dtype=object)
+    dates = dates.reindex(rules[matched]).to_numpy()
+    birth_dates = df['birth_date'].to_numpy(dtype=object)[matched]
+    illegitimate_dates = np.full(len(df), None, dtype=object)
+    illegitimate_dates[matched] = np.where(pd.isnull(dates), birth_dates, 
+        dates)
+    df['illegitimate_date'] = pd.Series(illegitimate_dates, index=df.index, 
+        dtype=object)
 
 def fill_succession(df, successors, parent_row):
+    '''Reference (recursive) implementation of the unfiltered succession, 
+    used to verify SuccessionGraph.
+    '''
     children = df.reindex(parent_row['children_ids'])
     # Sort children by absolute primogeniture
     children = children[children['external_url'].notnull()].sort_values('birth_date')
@@ -74,98 +200,958 @@ def fill_succession(df, successors, parent_row):
         succession = fill_succession(df, successors, row)
     return succession
 
-def get_succession(successors_df, date):
-    _df = successors_df
-    born = (_df['birth_date'] <= date)
-    alive = _df['death_date'].isnull() | (_df['death_date'] > date)
-    legitimate = _df['legitimate_date'].isnull() | (_df['legitimate_date'] <= date)
-    not_illegitimate = ~(_df['illegitimate_date'] <= date)
-    succession = _df[(born & alive & legitimate & not_illegitimate)].copy()
-    succession = succession.drop_duplicates('_id', keep='first')
+class SuccessionGraph(object):
+    '''The descendants as compact integer arrays for determining succession: 
+    CSR child adjacency (children with an external url only), birth ordinals, 
+    gender codes and Perth categories. Nodes are positions in the dataframe.
+    '''
+    # Arrays which do not depend on the rules (illegitimates and Perth 
+    # agreement dates), so can be shared between scenarios
+    ARRAYS = ('indptr', 'indices', 'birth_date', 'birth', 'gender', 
+        'is_female', 'is_male')
+
+    def __init__(self, df, perth_signed=PERTH_SIGNED, 
+            perth_effected=PERTH_EFFECTED, children=None):
+        self.ids = df.index
+        n = len(df)
+        # Child adjacency, keeping children which are present with a url
+        if children is None:
+            children_ids = df['children_ids'].tolist()
+            lengths = np.array([len(c) for c in children_ids], 
+                dtype=np.int64)
+            flat = [c for cs in children_ids for c in cs]
+            indices = self.ids.get_indexer(flat) if flat \
+                else np.zeros(0, dtype=np.int64)
+        else:
+            # Adjacency (see load_children) of the rows before cleaning, 
+            # mapped to the nodes
+            ids, indptr, indices = children
+            rows = ids.get_indexer(self.ids)
+            starts = indptr[rows]
+            lengths = indptr[rows + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, 
+                lengths)
+            nodes = np.full(len(ids), -1, dtype=np.int64)
+            nodes[rows] = np.arange(n)
+            indices = nodes[indices[offsets + np.arange(lengths.sum())]]
+        has_url = df['external_url'].notnull().to_numpy()
+        keep = indices >= 0
+        keep[keep] = has_url[indices[keep]]
+        parents = np.repeat(np.arange(n), lengths)
+        self.indptr = np.concatenate([[0], 
+            np.cumsum(np.bincount(parents[keep], minlength=n))])
+        self.indices = indices[keep]
+        # Birth ordinals (ISO date strings sort as dates)
+        self.birth_date = df['birth_date'].astype(str).to_numpy(dtype=str)
+        _, self.birth = np.unique(self.birth_date, return_inverse=True)
+        # Gender codes sort as gender descending, with nulls last
+        gender = df['gender']
+        isnull = gender.isnull().to_numpy()
+        values = gender.astype(str).to_numpy()
+        unique, inverse = np.unique(values[~isnull], return_inverse=True)
+        self.gender = np.full(n, len(unique), dtype=np.int64)
+        self.gender[~isnull] = len(unique) - 1 - inverse
+        self.is_female = (values == 'female') & ~isnull
+        self.is_male = (values == 'male') & ~isnull
+        # Own illegitimate dates
+        self.set_rules([None if pd.isnull(d) else d 
+            for d in df['illegitimate_date'].tolist()], 
+            perth_signed, perth_effected)
+
+    @classmethod
+    def from_arrays(cls, ids, arrays):
+        '''Graph from the rule independent arrays (see ARRAYS) of another 
+        graph, e.g. in shared memory. The rules must be set before use.
+        '''
+        graph = cls.__new__(cls)
+        graph.ids = ids
+        for key in cls.ARRAYS:
+            setattr(graph, key, arrays[key])
+        return graph
+
+    def arrays(self):
+        return {key: getattr(self, key) for key in self.ARRAYS}
+
+    def set_rules(self, illegitimate_date, perth_signed=PERTH_SIGNED, 
+            perth_effected=PERTH_EFFECTED):
+        '''Set the own illegitimate date of each node and the Perth agreement 
+        dates (None for no agreement, i.e. male primogeniture throughout).
+        '''
+        self.illegitimate_date = illegitimate_date
+        self.perth_signed = perth_signed
+        self.perth_effected = perth_effected
+        # Perth categories: -1 pre (male primogeniture), 1 post (absolute 
+        # primogeniture), 0 between signed and effected
+        if perth_signed is None or perth_effected is None:
+            self.perth = np.full(len(self.birth), -1)
+        else:
+            self.perth = np.where(self.birth_date <= perth_signed, -1, 
+                np.where(self.birth_date >= perth_effected, 1, 0))
+        self._orders = {}
+
+    def node(self, _id):
+        return self.ids.get_loc(_id)
+
+    def children(self, node):
+        '''Ordered children of a node as (child, illegitimate_date, 
+        legitimate_date) tuples, where the dates are those due to the Perth 
+        agreement (or the child's own illegitimate date).
+        '''
+        order = self._orders.get(node)
+        if order is None:
+            order = self._orders[node] = self._order(node)
+        return order
+
+    def _order(self, node):
+        children = self.indices[self.indptr[node]:self.indptr[node+1]]
+        children = [int(c) for c in children]
+        birth, gender, perth = self.birth, self.gender, self.perth
+        # Sort children by absolute primogeniture
+        children.sort(key=lambda c: birth[c])
+        categories = [perth[c] for c in children]
+        if all(c == -1 for c in categories):
+            # Male primogeniture
+            children.sort(key=lambda c: gender[c])
+            return [(c, self.illegitimate_date[c], None) for c in children]
+        if all(c == 1 for c in categories):
+            return [(c, self.illegitimate_date[c], None) for c in children]
+        # Handling for Perth agreement for children born after signing and 
+        # before coming into effect. Sons born in this period keep their 
+        # place ahead of elder daughters; the daughters also appear after 
+        # the youngest son as their place until the agreement is effected.
+        pre = sorted([c for c in children if perth[c] == -1], 
+            key=lambda c: gender[c])
+        between = [c for c in children if perth[c] == 0]
+        post = [c for c in children if perth[c] == 1]
+        keep_to = 0
+        for i, c in enumerate(between):
+            if self.is_male[c]:
+                keep_to = i + 1
+        order = pre + between[:keep_to] \
+            + [c for c in between if self.is_female[c]] + post
+        # Mark duplicate (females) as having (il)legitimate at effected date
+        counts = {}
+        for c in order:
+            counts[c] = counts.get(c, 0) + 1
+        seen = {}
+        result = []
+        for c in order:
+            seen[c] = seen.get(c, 0) + 1
+            first, last = seen[c] == 1, seen[c] == counts[c]
+            result.append((c, 
+                self.illegitimate_date[c] if first else self.perth_effected,
+                None if last else self.perth_effected))
+        return result
+
+    def succession(self, seed, depths=None):
+        '''Unfiltered succession from the seed node in pre-order, as a list of 
+        (node, illegitimate_date, legitimate_date) tuples. An explicit stack 
+        is used so that deep lines are not limited by recursion. Optionally 
+        the depth of each entry is appended to depths.
+
+        A person may be reached by several routes (e.g. cousin marriages). 
+        The subtree of each (node, illegitimate_date) is only expanded the 
+        first time it is reached, since any later expansion would only repeat 
+        the same successors further down the line. This is equivalent to 
+        dropping duplicate (_id, illegitimate_date) successors.
+        '''
+        entries, skipped = self.expand(
+            (seed, self.illegitimate_date[seed], None), depths=depths)
+        logging.info(f'Skipped {len(skipped)} repeated subtrees '
+            f'(at least {sum(skipped)} successors not expanded again)')
+        return entries
+
+    def expand(self, entry, is_visited=None, depth=0, depths=None):
+        '''Pre-order expansion of the subtree of an entry, as in succession. 
+        Keys (node, illegitimate_date) for which is_visited is true (e.g. 
+        expanded earlier in the line) are also skipped. Returns the entries, 
+        and the sizes of the skipped subtrees expanded within this subtree.
+        '''
+        node, illegitimate_date, _ = entry
+        key = (node, illegitimate_date)
+        entries = [entry]
+        sizes = {key: None}
+        skipped = []
+        stack = [(iter(self.children(node)), illegitimate_date, key, 0)]
+        if depths is not None:
+            depths.append(depth)
+        while stack:
+            children, parent_illegitimate_date, _key, start = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                sizes[_key] = len(entries) - start
+                continue
+            node, illegitimate_date, legitimate_date = child
+            illegitimate_date = parent_illegitimate_date or illegitimate_date
+            key = (node, illegitimate_date)
+            if key in sizes or (is_visited and is_visited(key)):
+                skipped.append(key)
+                continue
+            sizes[key] = None
+            if depths is not None:
+                depths.append(depth + len(stack))
+            stack.append((iter(self.children(node)), illegitimate_date, key, 
+                len(entries)))
+            entries.append((node, illegitimate_date, legitimate_date))
+        return entries, [sizes[key] for key in skipped if key in sizes]
+
+def descendant_signatures(df):
+    '''The fields of each descendant which the order of succession depends 
+    on, as strings.
+    '''
+    signatures = pd.DataFrame(index=df.index)
+    for key in ['birth_date', 'gender', 'illegitimate_date']:
+        values = df[key].astype(object)
+        signatures[key] = values.where(values.notnull(), '').astype(str)
+    signatures['external_url'] = df['external_url'].notnull()
+    signatures['children_ids'] = df['children_ids'].map('\n'.join)
+    return signatures
+
+class SuccessionCache(object):
+    '''Succession entries (by _id, with their depths) and descendant 
+    signatures of a previous run, to update the succession incrementally. 
+    
+    The blocks (subtrees) of the entries of changed descendants and the 
+    parents of changed descendants are expanded again and spliced into the 
+    previous entries. Since repeated subtrees are only expanded the first 
+    time, a block can only be spliced if it keeps all of its keys and only 
+    gains keys which are not elsewhere in the line; otherwise the update 
+    gives up and the succession must be determined in full.
+    '''
+    VERSION = 1
+
+    def __init__(self, seed, perth, signatures, entries, depths):
+        self.seed = seed
+        self.perth = perth
+        self.signatures = signatures
+        self.ids = np.array([_id for _id, _, _ in entries], dtype=object)
+        self.illegitimate_date = [i for _, i, _ in entries]
+        self.legitimate_date = [l for _, _, l in entries]
+        self.depths = np.asarray(depths, dtype=np.int64)
+
+    @classmethod
+    def from_graph(cls, graph, seed, signatures, entries, depths):
+        return cls(seed, (graph.perth_signed, graph.perth_effected), 
+            signatures, [(graph.ids[node], i, l) for node, i, l in entries], 
+            depths)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            version, cache = pickle.load(f)
+        if version != cls.VERSION:
+            raise ValueError(f'Unsupported succession cache version in {path}')
+        return cache
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump((self.VERSION, self), f, 
+                protocol=pickle.HIGHEST_PROTOCOL)
+
+    def changed(self, signatures):
+        '''Ids of descendants whose own fields (affecting their place among 
+        their siblings) changed, and whose children changed.
+        '''
+        old, new = self.signatures, signatures
+        common = new.index.intersection(old.index)
+        added = new.index.difference(old.index)
+        removed = old.index.difference(new.index)
+        old, new = old.loc[common], new.loc[common]
+        fields = ['birth_date', 'gender', 'illegitimate_date', 'external_url']
+        own = (old[fields] != new[fields]).any(axis=1).to_numpy()
+        children = (old['children_ids'] != new['children_ids']).to_numpy()
+        return common[own].append(added).append(removed), common[children]
+
+    def block_end(self, position):
+        deeper = self.depths[position+1:] > self.depths[position]
+        shallower = np.flatnonzero(~deeper)
+        return position + 1 + (shallower[0] if len(shallower) else len(deeper))
+
+    def update(self, graph, seed, df, signatures):
+        '''Succession entries and depths for the descendants (as in 
+        SuccessionGraph.succession), updated from the cached entries. Returns 
+        None if the update is not possible.
+        '''
+        if seed != self.seed \
+                or self.perth != (graph.perth_signed, graph.perth_effected):
+            logging.info('Seed or rules changed since the cached succession')
+            return None
+        own, children = self.changed(signatures)
+        if seed in own:
+            logging.info('Seed changed since the cached succession')
+            return None
+        # Parents of descendants which changed (and descendants whose 
+        # children changed) have their children ordered again
+        children_ids = df['children_ids'].tolist()
+        lengths = np.array([len(c) for c in children_ids], dtype=np.int64)
+        flat = pd.Index(list(itertools.chain.from_iterable(children_ids)))
+        parents = np.repeat(np.arange(len(df)), lengths)[flat.isin(own)]
+        dirty = children.append(df.index[parents]).unique()
+        logging.info(f'{len(own)} descendants changed, updating the '
+            f'succession of {len(dirty)} parents...')
+        # Index the previous keys by node
+        nodes = graph.ids.get_indexer(self.ids)
+        order = np.argsort(nodes, kind='stable')
+        sorted_nodes = nodes[order]
+        def positions(node, illegitimate_date):
+            lo, hi = np.searchsorted(sorted_nodes, [node, node + 1])
+            return [p for p in order[lo:hi].tolist() 
+                if self.illegitimate_date[p] == illegitimate_date]
+        # Expand the outermost blocks of the changed entries again
+        gained = set()
+        entries, depths = [], []
+        end = 0
+        for start in np.flatnonzero(pd.Index(self.ids).isin(dirty)).tolist():
+            if start < end:
+                continue
+            if (nodes[end:start] < 0).any():
+                return None
+            entries.extend(zip(nodes[end:start].tolist(), 
+                self.illegitimate_date[end:start], 
+                self.legitimate_date[end:start]))
+            depths.extend(self.depths[end:start].tolist())
+            end = self.block_end(start)
+            is_visited = lambda key: key in gained or any(
+                p < start for p in positions(*key))
+            block_depths = []
+            block, _ = graph.expand((nodes[start], 
+                self.illegitimate_date[start], self.legitimate_date[start]), 
+                is_visited, int(self.depths[start]), block_depths)
+            old_keys = set(zip(self.ids[start:end].tolist(), 
+                self.illegitimate_date[start:end]))
+            new_keys = set((graph.ids[node], i) for node, i, _ in block)
+            if old_keys - new_keys:
+                logging.info('Successors removed from the block of '
+                    f'{self.ids[start]}')
+                return None
+            for key in new_keys - old_keys:
+                if positions(graph.ids.get_loc(key[0]), key[1]):
+                    logging.info('Successors moved into the block of '
+                        f'{self.ids[start]}')
+                    return None
+            gained.update((graph.ids.get_loc(_id), i) 
+                for _id, i in new_keys - old_keys)
+            entries.extend(block)
+            depths.extend(block_depths)
+        if (nodes[end:] < 0).any():
+            return None
+        entries.extend(zip(nodes[end:].tolist(), self.illegitimate_date[end:], 
+            self.legitimate_date[end:]))
+        depths.extend(self.depths[end:].tolist())
+        return entries, depths
+
+def successors_frame(df, entries):
+    '''Dataframe of successors (with _id column) from succession entries.
+    '''
+    successors_df = df.iloc[[node for node, _, _ in entries]].reset_index()
+    successors_df['illegitimate_date'] = [i for _, i, _ in entries]
+    successors_df['legitimate_date'] = [l for _, _, l in entries]
+    successors_df['succession'] = range(len(entries))
+    return successors_df
+
+def write_json(path, data, **kwargs):
+    '''Write a JSON file atomically (via a temporary file), so that readers 
+    such as server.py never see a partially written file.
+    '''
+    with open(f'{path}.tmp', 'w+') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(f'{path}.tmp', path)
+
+def write_successors(successors_df, path, last_updated, csv_path=None):
+    '''Write the successors JSON file (omitting null fields), and optionally 
+    the CSV file.
+    '''
+    _df = successors_df.set_index('_id')[OUTPUT_COLUMNS].copy()
+    if csv_path:
+        _df.to_csv(csv_path)
+    _df['_id'] = _df.index
+    records = [{k: v for k, v in record.items() if pd.notnull(v)}
+        for record in _df.to_dict(orient='records')]
+    write_json(path, {'last_updated': last_updated, 'successors': records})
+
+def verify_succession(df, seed, successors_df):
+    '''Check the succession against the reference implementation.
+    '''
+    logging.info('Verifying against reference implementation...')
+    successors = [{'_id': seed, **df.loc[seed].to_dict(), 'succession': 0}]
+    fill_succession(df, successors, successors[0])
+    reference_df = pd.DataFrame(successors).sort_values('succession')
+    reference_df = reference_df.drop_duplicates(
+        ['_id', 'illegitimate_date'], keep='first')
+    columns = ['_id', 'illegitimate_date', 'legitimate_date']
+    expected = reference_df[columns].astype(object).where(
+        reference_df[columns].notnull(), None).values.tolist()
+    actual = successors_df[columns].astype(object).where(
+        successors_df[columns].notnull(), None).values.tolist()
+    if expected != actual:
+        raise AssertionError('Succession differs from reference '
+            f'implementation ({len(actual)} vs {len(expected)} successors)')
+    logging.info(f'Verified {len(actual)} successors')
+
+def to_days(dates, null=NEVER):
+    '''Convert ISO date strings (or dates) to integer days since the epoch, 
+    with nulls as the given value.
+    '''
+    dates = pd.Series(dates, dtype=object)
+    days = np.full(len(dates), null, dtype=np.int64)
+    notnull = dates.notnull().to_numpy()
+    if notnull.any():
+        days[notnull] = np.array(dates[notnull].astype(str).tolist(), 
+            dtype='datetime64[D]').astype(np.int64)
+    return days
+
+class FenwickTree(object):
+    '''Binary indexed tree of counts over positions, for prefix counts and 
+    finding the position with a given rank, both in O(log n).
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.step = 1 << size.bit_length()
+
+    def add(self, position, value):
+        i = position + 1
+        while i <= self.size:
+            self.tree[i] += value
+            i += i & -i
+
+    def prefix(self, position):
+        '''Total count of the positions before the position.
+        '''
+        total, i = 0, position
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, rank):
+        '''Position with the given (1-based) rank, i.e. the smallest position 
+        whose inclusive prefix count is the rank.
+        '''
+        i, step = 0, self.step
+        while step:
+            if i + step <= self.size and self.tree[i + step] < rank:
+                i += step
+                rank -= self.tree[i]
+            step >>= 1
+        return i
+
+class SuccessionIndex(object):
+    '''Index of the eligibility interval of each successor entry, for querying 
+    the line of succession at dates. An entry is eligible from its birth (or 
+    legitimate date, if later) until its death or illegitimate date (if 
+    earlier). The line only changes at these dates, which are swept once 
+    into the timeline of changes to the line. The count of entries in the 
+    line before each position is checkpointed every k changes (with k chosen 
+    to keep the checkpoints within checkpoint_bytes), so the top of the line 
+    at a date is a binary search of the nearest checkpoint, corrected by the 
+    changes since it, in O(top log N + k) for N entries.
+    '''
+    def __init__(self, successors_df, cache_size=256, checkpoint_bytes=2**26):
+        self.ids = successors_df['_id'].to_numpy(dtype=object)
+        _, self._codes = np.unique(self.ids.astype(str), return_inverse=True)
+        # Entries without a birth date are never eligible
+        self.start = np.maximum(to_days(successors_df['birth_date']), 
+            to_days(successors_df['legitimate_date'], null=-NEVER))
+        self.end = np.minimum(to_days(successors_df['death_date']), 
+            to_days(successors_df['illegitimate_date']))
+        dates = np.concatenate([self.start, self.end])
+        self.changes = np.unique(dates[dates != NEVER])
+        self.checkpoint_bytes = checkpoint_bytes
+        self._line = lru_cache(maxsize=cache_size)(self._line)
+        self._timeline = None
+        self._event_arrays = None
+        self._checkpoints = None
+
+    def segment(self, date):
+        '''Index of the period (between change dates) containing the date(s).
+        '''
+        return np.searchsorted(self.changes, to_days(np.atleast_1d(date)), 
+            side='right')
+
+    def _checkpoint(self):
+        '''The days of the changes in the timeline, the number of changes 
+        between checkpoints, and the checkpoints: the cumulative count of the 
+        entries in the line after each multiple of that number of changes.
+        '''
+        if self._checkpoints is None:
+            timeline = self.timeline()
+            count = max(1, min(len(timeline) + 1, 
+                self.checkpoint_bytes // (4 * max(len(self.ids), 1))))
+            interval = -(-(len(timeline) + 1) // count)
+            in_line = np.zeros(len(self.ids), dtype=bool)
+            checkpoints = []
+            for i, (_, added, removed, _) in enumerate(timeline):
+                if i % interval == 0:
+                    checkpoints.append(np.cumsum(in_line, dtype=np.int32))
+                in_line[removed] = False
+                in_line[added] = True
+            if len(timeline) % interval == 0:
+                checkpoints.append(np.cumsum(in_line, dtype=np.int32))
+            days = np.array([day for day, _, _, _ in timeline], dtype=np.int64)
+            self._checkpoints = (days, interval, checkpoints)
+        return self._checkpoints
+
+    def _line(self, applied, top):
+        '''Positions of the entries in the line after the first applied 
+        changes in the timeline, from the nearest checkpoint before it.
+        '''
+        _, interval, checkpoints = self._checkpoint()
+        counts = checkpoints[applied // interval]
+        size = int(counts[-1]) if len(counts) else 0
+        # The net changes since the checkpoint, from the first and last change 
+        # of each entry
+        changes, positions, signs = self._events()
+        lo, hi = np.searchsorted(changes, 
+            [applied // interval * interval, applied])
+        positions, signs = positions[lo:hi], signs[lo:hi]
+        entries, first = np.unique(positions, return_index=True)
+        _, last = np.unique(positions[::-1], return_index=True)
+        was_in = signs[first] < 0
+        is_in = signs[len(positions) - 1 - last] > 0
+        added, removed = entries[is_in & ~was_in], entries[was_in & ~is_in]
+        if top is None:
+            line = np.flatnonzero(np.diff(counts, prepend=0))
+        else:
+            # Entries of rank 1 to top (plus those since removed) at the 
+            # checkpoint
+            line = np.searchsorted(counts, np.arange(1, 
+                min(top + len(removed), size) + 1))
+        line = np.sort(np.concatenate([line[~np.isin(line, removed)], added]))
+        return line if top is None else line[:top]
+
+    def line(self, date, top=None):
+        '''Positions of the successor entries in the line at the date, in 
+        order. Optionally only the top entries.
+        '''
+        days, _, _ = self._checkpoint()
+        applied = int(np.searchsorted(days, to_days([date])[0], side='right'))
+        return self._line(applied, top)
+
+    def lines(self, dates, top=None):
+        '''Positions of the successor entries in the line at each date. The 
+        changes in the timeline are applied in one sweep over the sorted 
+        dates, rather than scanning and deduplicating every entry for each 
+        date. Each line is then read in O(N), or with top, in O(top log N) 
+        from a Fenwick tree of the entries in the line.
+        '''
+        timeline = self.timeline()
+        days = to_days(np.atleast_1d(dates))
+        counts = np.searchsorted([day for day, _, _, _ in timeline], days, 
+            side='right').tolist()
+        if top is None:
+            in_line = np.zeros(len(self.ids), dtype=bool)
+        else:
+            tree = FenwickTree(len(self.ids))
+        lines = [None] * len(counts)
+        applied, line = 0, None
+        for i in sorted(range(len(counts)), key=counts.__getitem__):
+            if counts[i] != applied or line is None:
+                for _, added, removed, _ in timeline[applied:counts[i]]:
+                    if top is None:
+                        in_line[removed] = False
+                        in_line[added] = True
+                        continue
+                    for p in removed:
+                        tree.add(p, -1)
+                    for p in added:
+                        tree.add(p, 1)
+                applied = counts[i]
+                if top is None:
+                    line = np.flatnonzero(in_line)
+                else:
+                    size = timeline[applied - 1][3] if applied else 0
+                    line = np.array([tree.find(r) 
+                        for r in range(1, min(top, size) + 1)], dtype=np.int64)
+            lines[i] = line
+        return lines
+
+    def timeline(self):
+        '''Sweep over the change dates once, returning the changes in the line 
+        as lists of (day, added positions, removed positions, line size). 
+        A person's entry is in the line when it is their first eligible entry.
+        '''
+        if self._timeline is not None:
+            return self._timeline
+        valid = self.start < self.end
+        positions = np.flatnonzero(valid)
+        events = sorted([(day, 0, p) for day, p 
+            in zip(self.start[valid].tolist(), positions.tolist())] 
+            + [(day, 1, p) for day, p 
+            in zip(self.end[valid].tolist(), positions.tolist()) 
+            if day != NEVER])
+        codes = self._codes.tolist()
+        eligible = {}
+        size = 0
+        timeline = []
+        for day, day_events in itertools.groupby(events, key=lambda e: e[0]):
+            day_events = list(day_events)
+            people = set(codes[p] for _, _, p in day_events)
+            before = {c: min(eligible[c]) if eligible.get(c) else None 
+                for c in people}
+            # Starts sort before ends, so empty intervals cancel out
+            for _, is_end, p in day_events:
+                if is_end:
+                    eligible[codes[p]].discard(p)
+                else:
+                    eligible.setdefault(codes[p], set()).add(p)
+            added, removed = [], []
+            for c in people:
+                after = min(eligible[c]) if eligible[c] else None
+                if after != before[c]:
+                    if before[c] is not None:
+                        removed.append(before[c])
+                    if after is not None:
+                        added.append(after)
+            size += len(added) - len(removed)
+            if added or removed:
+                timeline.append((day, sorted(added), sorted(removed), size))
+        self._timeline = timeline
+        return timeline
+
+    def _events(self):
+        '''The timeline as flat arrays of the change index, position and 
+        count (1 added, -1 removed) of each change to the line.
+        '''
+        if self._event_arrays is None:
+            timeline = self.timeline()
+            lengths = [len(added) + len(removed) 
+                for _, added, removed, _ in timeline]
+            self._event_arrays = (
+                np.repeat(np.arange(len(timeline)), lengths),
+                np.array([p for _, added, removed, _ in timeline 
+                    for p in added + removed], dtype=np.int64),
+                np.array([c for _, added, removed, _ in timeline 
+                    for c in [1] * len(added) + [-1] * len(removed)], 
+                    dtype=np.int64))
+        return self._event_arrays
+
+    def rank_history(self, _id):
+        '''Rank (1-based) of the person in the line over time, as a list of 
+        (day, rank) from each day the rank changes. The rank is None while 
+        the person is not in the line. The rank at each change is the count 
+        of entries in the line before the person's entry, which is a 
+        cumulative sum over the changes to the line before that entry.
+        '''
+        entries = np.flatnonzero(self.ids == _id)
+        if not len(entries):
+            raise KeyError(_id)
+        timeline = self.timeline()
+        changes, positions, counts = self._events()
+        # The position of the person's entry in the line after each change 
+        # (or -1), which only changes at the person's own changes
+        position = np.full(len(timeline), -1, dtype=np.int64)
+        own = np.isin(positions, entries)
+        current = -1
+        for change, p, count in zip(changes[own].tolist(), 
+                positions[own].tolist(), counts[own].tolist()):
+            if count > 0:
+                current = p
+            elif p == current:
+                current = -1
+            position[change:] = current
+        ranks = np.zeros(len(timeline), dtype=np.int64)
+        for p in np.unique(position[position >= 0]).tolist():
+            before = positions < p
+            line = np.cumsum(np.bincount(changes[before], 
+                weights=counts[before], minlength=len(timeline)))
+            ranks[position == p] = line[position == p] + 1
+        history = []
+        rank = None
+        for change in np.flatnonzero(np.diff(np.concatenate([[0], 
+                np.where(position >= 0, ranks, 0)]))).tolist():
+            rank = int(ranks[change]) if position[change] >= 0 else None
+            history.append((timeline[change][0], rank))
+        return history
+
+    def rank_histories(self, limit=None):
+        '''Rank histories (as rank_history) of everyone in the line, in one 
+        sweep. With a limit, only ranks in the top limit are recorded, and 
+        the rank is None while below the limit. Only the ranks from the 
+        first change to the limit are looked up at each change date.
+        '''
+        codes = self._codes.tolist()
+        tree = FenwickTree(len(self.ids))
+        line = []  # Codes of the top of the line
+        ranks = {}
+        histories = {}
+        for day, added, removed, size in self.timeline():
+            for p in removed:
+                tree.add(p, -1)
+            for p in added:
+                tree.add(p, 1)
+            first = tree.prefix(min(added + removed))
+            stop = size if limit is None else min(size, limit)
+            tail = [codes[tree.find(r)] for r in range(first + 1, stop + 1)]
+            for code in line[first:]:
+                ranks[code] = None
+            for r, code in enumerate(tail, start=first + 1):
+                ranks[code] = r
+            for code in set(line[first:] + tail):
+                history = histories.setdefault(code, [])
+                if not history or history[-1][1] != ranks[code]:
+                    history.append((day, ranks[code]))
+            line[first:] = tail
+        return {self.ids[np.flatnonzero(self._codes == code)[0]]: history 
+            for code, history in histories.items()}
+
+def days_to_iso(day):
+    return str(np.datetime64(int(day), 'D'))
+
+def write_timeline(index, path, last_updated):
+    '''Write the timeline of changes in the line, as positions in the 
+    successors list. The line at any date is rebuilt by applying the 
+    changes up to that date.
+    '''
+    timeline = index.timeline()
+    write_json(path, {
+        'last_updated': last_updated,
+        'dates': [days_to_iso(day) for day, _, _, _ in timeline],
+        'added': [added for _, added, _, _ in timeline],
+        'removed': [removed for _, _, removed, _ in timeline],
+        'sizes': [size for _, _, _, size in timeline],
+    }, separators=(',', ':'))
+    logging.info(f'Wrote {len(timeline)} changes to {path}')
+
+def write_rank_histories(index, path, last_updated, limit=None):
+    '''Write the rank history of everyone reaching the top of the line.
+    '''
+    histories = index.rank_histories(limit)
+    write_json(path, {
+        'last_updated': last_updated,
+        'limit': limit,
+        'histories': {_id: [[days_to_iso(day), rank] for day, rank in history] 
+            for _id, history in histories.items()},
+    }, separators=(',', ':'))
+    logging.info(f'Wrote rank histories of {len(histories)} persons to {path}')
+
+def get_succession(successors_df, date, index=None):
+    '''Line of succession at the date, indexed by _id.
+    '''
+    index = index or SuccessionIndex(successors_df)
+    succession = successors_df.iloc[index.line(date)].copy()
     succession['succession'] = list(range(len(succession)))
     succession = succession.set_index('_id')
     return succession
 
+# Descendants (shared memory, graph and output columns) of the scenario 
+# worker processes
+_scenario = None
+
+def share_arrays(arrays):
+    '''Copy arrays into one block of shared memory. Returns the shared memory 
+    and a spec of each array's (dtype, shape, offset) for attach_arrays.
+    '''
+    spec, size = {}, 0
+    for key, array in arrays.items():
+        spec[key] = (array.dtype.str, array.shape, size)
+        size += -(-array.nbytes // 8) * 8
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for key, array in arrays.items():
+        dtype, shape, offset = spec[key]
+        np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)[...] = array
+    return shm, spec
+
+def attach_arrays(name, spec):
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {key: np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+        for key, (dtype, shape, offset) in spec.items()}
+    return shm, arrays
+
+def scenario_arrays(df, graph):
+    '''Rule independent arrays of the (cleaned) descendants, to compute and 
+    output the succession of any scenario.
+    '''
+    arrays = {'_id': df.index.to_numpy(dtype=str), **graph.arrays()}
+    for key in ['name', 'death_date', 'external_url']:
+        values = df[key].tolist()
+        arrays[key] = np.array(['' if pd.isnull(v) else str(v) 
+            for v in values], dtype=str)
+        arrays[f'{key}.isnull'] = pd.isnull(np.array(values, dtype=object))
+    return arrays
+
+def _init_scenario_worker(name, spec):
+    shm, arrays = attach_arrays(name, spec)
+    _set_scenario(arrays, shm)
+
+def _set_scenario(arrays, shm=None):
+    global _scenario
+    ids = pd.Index(arrays['_id'].tolist(), name='_id')
+    graph = SuccessionGraph.from_arrays(ids, arrays)
+    data = {'birth_date': arrays['birth_date'].tolist()}
+    for key in ['name', 'death_date', 'external_url']:
+        data[key] = pd.Series(arrays[key].tolist(), dtype=object)
+        data[key][arrays[f'{key}.isnull']] = None
+    df = pd.DataFrame(data)
+    df.index = ids
+    _scenario = (shm, graph, df)
+
+def _run_scenario(scenario):
+    start = time.perf_counter()
+    _, graph, df = _scenario
+    illegitimate_date = [None] * len(df)
+    for node, date in scenario['illegitimate_date'].items():
+        illegitimate_date[node] = date
+    graph.set_rules(illegitimate_date, scenario['perth_signed'], 
+        scenario['perth_effected'])
+    entries = graph.succession(scenario['seed'])
+    write_successors(successors_frame(df, entries), scenario['path'], 
+        scenario['last_updated'])
+    return scenario['name'], len(entries), time.perf_counter() - start
+
+def run_scenarios(df, scenarios, seed, processes=1, children=None):
+    '''Determine the succession of each scenario from the cleaned descendants, 
+    writing successors-<name>.json for each. A scenario may set the seed, 
+    illegitimates file, and Perth agreement dates (null for no agreement). 
+    The illegitimates are resolved up front, and the rest of the descendants 
+    are shared by the worker processes in shared memory. The children are 
+    as for SuccessionGraph.
+    '''
+    last_updated = datetime.utcnow().isoformat()
+    graph = SuccessionGraph(df.assign(illegitimate_date=None), 
+        children=children)
+    tasks = []
+    for scenario in scenarios:
+        name = scenario['name']
+        logging.info(f'Resolving illegitimates of scenario {name}...')
+        _df = df.copy(deep=False)
+        apply_illegitimates(_df, load_illegitimates(
+            scenario.get('illegitimates', 'illegitimates.yml')))
+        dates = _df['illegitimate_date'].to_numpy()
+        tasks.append({
+            'name': name,
+            'seed': graph.node(scenario.get('seed', seed)),
+            'illegitimate_date': {int(node): dates[node] 
+                for node in np.flatnonzero(pd.notnull(dates))},
+            'perth_signed': scenario.get('perth_signed', PERTH_SIGNED),
+            'perth_effected': scenario.get('perth_effected', PERTH_EFFECTED),
+            'path': f'successors-{name}.json',
+            'last_updated': last_updated,
+        })
+    arrays = scenario_arrays(df, graph)
+    logging.info(f'Determining succession of {len(tasks)} scenarios...')
+    if processes > 1:
+        shm, spec = share_arrays(arrays)
+        try:
+            with multiprocessing.Pool(processes, 
+                    initializer=_init_scenario_worker, 
+                    initargs=(shm.name, spec)) as pool:
+                results = list(pool.imap_unordered(_run_scenario, tasks))
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        _set_scenario(arrays)
+        results = [_run_scenario(task) for task in tasks]
+    for name, total, elapsed in results:
+        logging.info(f'Scenario {name}: {total} successors in '
+            f'{elapsed:.2f} seconds')
+
 def main():
     
     # Define and parse arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--descendants', type=str, default='geni.yml',
-        help='YAML file for descendants.')
+        help='YAML file (or columnar directory) for descendants.')
     parser.add_argument('--seed', type=str, 
         default='0557aac6-264c-5a83-8f1e-a3f6cfac8b9a',
         help='Seed ancestor (Sophia of Hanover).')
+    parser.add_argument('--verify', action='store_true',
+        help='Verify the succession against the (slow) reference '
+            'implementation.')
+    parser.add_argument('--history-limit', type=int, default=100,
+        help='Only record rank histories in the top of the line (0 for the '
+            'whole line).')
+    parser.add_argument('--cache', type=str, default=None,
+        help='File caching the succession, to update it incrementally from '
+            'the previous run.')
+    parser.add_argument('--scenarios', type=str, default=None,
+        help='YAML file of scenarios (rule variants) to determine the '
+            'succession of, instead of the default rules.')
+    parser.add_argument('--processes', type=int, default=1,
+        help='Number of processes for the scenarios.')
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    metrics.publish(args.metrics_file, args.metrics_port, 
+        args.metrics_interval)
 
     # Load the descendants
     logging.info('Loading descendants...')
-    with open(args.descendants, 'r') as f:
-        rows = yaml.safe_load(f)
-    # Store in dataframe
-    df = pd.DataFrame(rows).set_index('_id')
+    with metrics.stage('load'):
+        df = load_descendants(args.descendants)
+        children = load_children(args.descendants)
+
+    # Alternatively determine the succession of each scenario
+    if args.scenarios:
+        with open(args.scenarios, 'r') as f:
+            scenarios = yaml.safe_load(f)
+        with metrics.stage('scenarios'):
+            run_scenarios(clean_descendants(df), scenarios, args.seed, 
+                args.processes, children)
+        metrics.close()
+        return
 
     # Load in the illegitimates
     logging.info('Loading illegitimates...')
-    with open('illegitimates.yml', 'r') as f:
-        illegitimates = yaml.safe_load(f)
-    # Define the illegitimate column
-    df['illegitimate_date'] = None
-    # Set illegitimates according to rules in the file
-    for illegitimate in illegitimates:
-        date = illegitimate.get('date')
-        for key, value in illegitimate['match'].items():
-            set_illegitimate(df, key, value, date)
+    with metrics.stage('illegitimates'):
+        illegitimates = load_illegitimates('illegitimates.yml')
+        # Set illegitimates according to rules in the file
+        apply_illegitimates(df, illegitimates)
     # Log how many illegitimates
     illegitimate_total = sum(df['illegitimate_date'].notnull())
     logging.info(f'Marked {illegitimate_total} illegitimate.')
 
     # Do some cleaning
-    logging.info(f'Cleaning total of {len(df)} descendants...')
-    # Delete null birth dates
-    cond = df['birth_date'].isnull()
-    logging.info(f'Deleting {sum(cond)} descendants without birth date...')
-    df = df[~cond]
-    # Delete null death dates
-    cond = df['death_date'].isnull() & ~df['is_alive'].isnull() \
-        & (df['is_alive'] == False)
-    logging.info(f'Deleting {sum(cond)} dead descendants without death date...')
-    df = df[~cond]
-    # Delete anyone with birth later than death
-    cond = df['death_date'].notnull() & (df['death_date'] < df['birth_date'])
-    logging.info(f'Deleting {sum(cond)} impossible birth/death dates...')
-    df = df[~cond]
-    # All done
-    total = len(df)
-    logging.info(f'Done cleaning! Total of {total} descendants remain')
+    with metrics.stage('clean'):
+        df = clean_descendants(df)
 
     # Determine unfiltered order of succession
-    # NOTE: There are duplicates if there are multiple possible lines 
-    # of succession, and due to Perth agreement.
+    # NOTE: There are duplicates due to the Perth agreement, and if there 
+    # are multiple possible lines of succession with differing legitimacy.
     df['legitimate_date'] = None
     logging.info('Determining unfiltered succession...')
-    successors = [{'_id': args.seed, **df.loc[args.seed].to_dict(), 
-        'succession': 0}]
-    fill_succession(df, successors, successors[0])
-    successors_df = pd.DataFrame(successors).sort_values('succession')
-    successors_df = successors_df.drop_duplicates(
-        ['_id', 'illegitimate_date'], keep='first')
-    logging.info('Done!')
+    with metrics.stage('succession'):
+        graph = SuccessionGraph(df, children=children)
+        entries = None
+        if args.cache:
+            signatures = descendant_signatures(df)
+            if os.path.exists(args.cache):
+                cache = SuccessionCache.load(args.cache)
+                update = cache.update(graph, args.seed, df, signatures)
+                if update is None:
+                    logging.info('Could not update the cached succession')
+                else:
+                    logging.info('Updated the cached succession')
+                    entries, depths = update
+        if entries is None:
+            depths = []
+            entries = graph.succession(graph.node(args.seed), depths)
+        if args.cache:
+            SuccessionCache.from_graph(graph, args.seed, signatures, entries, 
+                depths).save(args.cache)
+        successors_df = successors_frame(df, entries)
+    logging.info(f'Done! Total of {len(successors_df)} successors')
+    metrics.gauge('successors', len(successors_df))
+    if args.verify:
+        with metrics.stage('verify'):
+            verify_succession(df, args.seed, successors_df)
 
     # Output to files
     logging.info('Outputting to files...')
-    _df = successors_df.set_index('_id')[['name', 'birth_date', 'death_date', 
-        'illegitimate_date', 'legitimate_date', 'external_url']].copy()
-    _df.to_csv('successors.csv')
-    _df['_id'] = _df.index
-    records = [{k: v for k, v in record.items() if v is not None}
-        for record in _df.to_dict(orient='records')]
-    with open('successors.json', 'w+') as f:
-        json.dump({'last_updated': datetime.utcnow().isoformat(), 
-            'successors': records}, f)
+    last_updated = datetime.utcnow().isoformat()
+    with metrics.stage('output'):
+        write_successors(successors_df, 'successors.json', last_updated, 
+            'successors.csv')
+        index = SuccessionIndex(successors_df)
+        write_timeline(index, 'timeline.json', last_updated)
+        write_rank_histories(index, 'histories.json', last_updated, 
+            args.history_limit or None)
+    metrics.close()
 
     # Print an example
     logging.info('Succession at 2020-01-01 is: '
-        f'{get_succession(successors_df, "2020-01-01")}')
+        f'{get_succession(successors_df, "2020-01-01", index)}')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,249 @@
+'''Metrics for monitoring long runs of geni.py and main.py. Counters, gauges
+and summaries (e.g. of durations) are kept in a thread safe registry, which
+can be written periodically to a JSON file and served in the Prometheus text
+format. Stages record their wall time and peak memory.
+
+The module level functions use a default registry, e.g.
+
+    metrics.inc('geni_requests_total', kind='profile')
+    with metrics.timer('geni_store_insert_seconds', table='profiles'):
+        ...
+    with metrics.stage('crawl'):
+        ...
+'''
+
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+def peak_rss():
+    '''Peak resident set size of this process (since the last reset) in
+    bytes.
+    '''
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def reset_peak_rss():
+    '''Reset the peak resident set size, where supported (Linux). Elsewhere
+    the peak is of the process so far.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _key(name, labels):
+    '''Prometheus style key of a metric with labels.
+    '''
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"'
+        for k, v in sorted(labels.items())) + '}'
+
+class Metrics(object):
+    '''Registry of counters, gauges and summaries (count, sum and maximum of
+    observed values), keyed by name and labels.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+        self._names = {}
+        self._started = time.time()
+        # Counters at the last snapshot, for rates
+        self._last = (time.monotonic(), {})
+        self._path = None
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._names[name] = 'counter'
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._names[name] = 'gauge'
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._names[name] = 'summary'
+            count, total, peak = self._summaries.get(key, (0, 0, value))
+            self._summaries[key] = (count + 1, total + value,
+                max(peak, value))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''Observe the seconds taken by the block.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        '''Record the wall time and peak memory of a stage.
+        '''
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = peak_rss()
+            self.gauge('stage_seconds', seconds, stage=name)
+            self.gauge('stage_peak_bytes', peak, stage=name)
+            logging.info(f'Stage {name} took {seconds:.2f} seconds (peak '
+                f'memory {peak / 2 ** 20:.0f} MB)')
+
+    def get(self, name, **labels):
+        '''Current value of a counter or gauge (or summary tuple).
+        '''
+        key = _key(name, labels)
+        with self._lock:
+            for values in (self._counters, self._gauges, self._summaries):
+                if key in values:
+                    return values[key]
+        return None
+
+    def snapshot(self):
+        '''The metrics as a dictionary, with the rates of the counters since
+        the last snapshot and their mean rates since the start.
+        '''
+        now = time.monotonic()
+        uptime = time.time() - self._started
+        with self._lock:
+            last_time, last_counters = self._last
+            elapsed = now - last_time
+            rates = {key: (value - last_counters.get(key, 0)) / elapsed
+                for key, value in self._counters.items()} if elapsed else {}
+            self._last = (now, dict(self._counters))
+            return {
+                'time': datetime.utcnow().isoformat(),
+                'uptime_seconds': uptime,
+                'counters': dict(self._counters),
+                'rates': rates,
+                'mean_rates': {key: value / uptime
+                    for key, value in self._counters.items()},
+                'gauges': dict(self._gauges),
+                'summaries': {key: {'count': count, 'sum': total,
+                    'max': peak} for key, (count, total, peak)
+                    in self._summaries.items()},
+            }
+
+    def prometheus(self):
+        '''The metrics in the Prometheus text format.
+        '''
+        with self._lock:
+            lines = []
+            for name, kind in sorted(self._names.items()):
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'summary':
+                    for key, (count, total, _) in self._summaries.items():
+                        if key.split('{')[0] == name:
+                            labels = key[len(name):]
+                            lines.append(f'{name}_count{labels} {count}')
+                            lines.append(f'{name}_sum{labels} {total}')
+                    continue
+                values = self._counters if kind == 'counter' else self._gauges
+                for key, value in values.items():
+                    if key.split('{')[0] == name:
+                        lines.append(f'{key} {value}')
+            lines.append('# TYPE uptime_seconds gauge')
+            lines.append(f'uptime_seconds {time.time() - self._started}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Write a snapshot to a JSON file atomically.
+        '''
+        with open(f'{path}.tmp', 'w+') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+    def publish(self, path=None, port=None, interval=10, host='127.0.0.1'):
+        '''Write the metrics to a JSON file every interval seconds, and/or
+        serve them in the Prometheus text format on a port, from background
+        threads.
+        '''
+        if path:
+            self._path = path
+            def write():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.write(path)
+                    except OSError as err:
+                        logging.warning(f'Failed to write metrics to '
+                            f'{path}: "{err}"')
+            threading.Thread(target=write, daemon=True).start()
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            self._server.metrics = self
+            threading.Thread(target=self._server.serve_forever,
+                daemon=True).start()
+            logging.info(f'Serving metrics on http://{host}:{port}/metrics')
+
+    def close(self):
+        '''Write the final metrics and stop serving them.
+        '''
+        if self._path:
+            self.write(self._path)
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            return self.send_error(404)
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def add_arguments(parser):
+    parser.add_argument('--metrics-file', type=str, default=None,
+        help='JSON file to write the metrics to periodically.')
+    parser.add_argument('--metrics-port', type=int, default=None,
+        help='Port to serve the metrics on in the Prometheus text format.')
+    parser.add_argument('--metrics-interval', type=float, default=10,
+        help='Seconds between writes of the metrics file.')
+
+# Default registry
+default = Metrics()
+inc = default.inc
+gauge = default.gauge
+observe = default.observe
+timer = default.timer
+stage = default.stage
+publish = default.publish
+close = default.close
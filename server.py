@@ -0,0 +1,240 @@
+'''Server for querying the line of succession from the successors.json file
+written by main.py. The successors are loaded once into a SuccessionIndex,
+and the file is reloaded (without interrupting requests) when it changes.
+
+- /line?date=D&top=N: the top N (or all) in the line at the date.
+- /person/<id>/history: the rank history of the person.
+- /changes?from=D1&to=D2: changes in the line after D1 up to D2.
+'''
+
+import argparse
+from collections import OrderedDict
+from datetime import date
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from main import SuccessionIndex, days_to_iso, to_days
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 512
+# Compression level (the default of 9 takes several times longer for a few
+# percent smaller responses)
+GZIP_LEVEL = 1
+
+class LRUCache(object):
+    '''Thread safe least recently used cache of responses.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return value
+
+class Successors(object):
+    '''The successors (one version of successors.json) indexed for queries,
+    with a cache of encoded responses.
+    '''
+    def __init__(self, path, cache_size=1024):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        start = time.perf_counter()
+        with open(path, 'r') as f:
+            data = json.load(f)
+        self.last_updated = data['last_updated']
+        self.records = data['successors']
+        self.index = SuccessionIndex(pd.DataFrame(self.records,
+            columns=['_id', 'birth_date', 'death_date', 'illegitimate_date',
+                'legitimate_date']))
+        # Sweep the changes up front, rather than in the first request
+        timeline = self.index.timeline()
+        self.days = np.array([day for day, _, _, _ in timeline],
+            dtype=np.int64)
+        self.cache = LRUCache(cache_size)
+        logging.info(f'Loaded {len(self.records)} successors (last updated '
+            f'{self.last_updated}) in {time.perf_counter() - start:.2f} '
+            'seconds')
+
+    def line(self, date, top=None):
+        '''The line at a date. Dates in the same period between changes share
+        a cached response.
+        '''
+        segment = int(self.index.segment(date)[0])
+        def compute():
+            positions = self.index.line(date, top)
+            changes = self.index.changes
+            return encode({
+                'last_updated': self.last_updated,
+                'from': days_to_iso(changes[segment - 1]) if segment else None,
+                'to': days_to_iso(changes[segment])
+                    if segment < len(changes) else None,
+                'successors': [self.records[p] for p in positions],
+            })
+        return self.cache.get(('line', segment, top), compute)
+
+    def history(self, _id):
+        def compute():
+            history = self.index.rank_history(_id)
+            dates = iso_dates([day for day, _ in history])
+            return encode({
+                'last_updated': self.last_updated,
+                '_id': _id,
+                'history': [[date, rank]
+                    for date, (_, rank) in zip(dates, history)],
+            })
+        return self.cache.get(('history', _id), compute)
+
+    def changes(self, start=None, end=None):
+        '''Changes in the line after the start date, up to the end date.
+        '''
+        lo = 0 if start is None else int(np.searchsorted(self.days,
+            to_days([start])[0], side='right'))
+        hi = len(self.days) if end is None else int(np.searchsorted(
+            self.days, to_days([end])[0], side='right'))
+        def compute():
+            ids = self.index.ids
+            timeline = self.index.timeline()[lo:hi]
+            dates = iso_dates(self.days[lo:hi])
+            return encode({
+                'last_updated': self.last_updated,
+                'changes': [{
+                    'date': date,
+                    'added': [ids[p] for p in added],
+                    'removed': [ids[p] for p in removed],
+                    'size': size,
+                } for date, (_, added, removed, size)
+                    in zip(dates, timeline)],
+            })
+        return self.cache.get(('changes', lo, hi), compute)
+
+def encode(data):
+    '''JSON encode a response, with a gzipped version if worthwhile.
+    '''
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return body, gzip.compress(body, compresslevel=GZIP_LEVEL) \
+        if len(body) >= GZIP_MIN_SIZE else None
+
+def iso_dates(days):
+    return np.array(days, dtype='datetime64[D]').astype(str).tolist()
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, so don't wait to coalesce them
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        # Clients may disconnect before (or while) their response is written
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def do_GET(self):
+        # Requests use the successors loaded when they arrive, so a reload
+        # does not affect requests in flight
+        successors = self.server.successors
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        try:
+            if parts == ['line']:
+                top = int(query['top']) if 'top' in query else None
+                if top is not None and top < 0:
+                    raise ValueError(f'Negative top {top}')
+                response = successors.line(
+                    query.get('date', date.today().isoformat()), top)
+            elif len(parts) == 3 and parts[0] == 'person' \
+                    and parts[2] == 'history':
+                response = successors.history(parts[1])
+            elif parts == ['changes']:
+                response = successors.changes(query.get('from'),
+                    query.get('to'))
+            else:
+                return self.send_error(404)
+        except KeyError as err:
+            return self.send_error(404, f'Unknown {err}')
+        except ValueError as err:
+            return self.send_error(400, str(err))
+        body, gzipped = response
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if gzipped and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzipped
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def watch(server, path, interval, cache_size):
+    '''Reload the successors when the file changes. The new successors are
+    loaded in full before replacing the old ones.
+    '''
+    while True:
+        time.sleep(interval)
+        try:
+            if os.stat(path).st_mtime == server.successors.mtime:
+                continue
+            server.successors = Successors(path, cache_size)
+        except (OSError, ValueError, KeyError) as err:
+            logging.warning(f'Failed to reload {path}: "{err}"')
+
+def main():
+
+    # Define and parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--successors', type=str, default='successors.json',
+        help='Successors JSON file written by main.py.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+        help='Host to listen on.')
+    parser.add_argument('--port', type=int, default=8000,
+        help='Port to listen on.')
+    parser.add_argument('--cache-size', type=int, default=1024,
+        help='Number of responses to cache.')
+    parser.add_argument('--reload-interval', type=float, default=5,
+        help='Seconds between checks for a new successors file.')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.successors = Successors(args.successors, args.cache_size)
+    threading.Thread(target=watch, args=(server, args.successors,
+        args.reload_interval, args.cache_size), daemon=True).start()
+    logging.info(f'Serving on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
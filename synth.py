@@ -0,0 +1,322 @@
+'''Synthetic genealogies for benchmarking main.py. Generates the descendants
+of a seed born in 1630 in the simplified row format written by geni.py, with
+the features of the real data which the succession depends on:
+
+- Generations growing to the requested size by the present day, so that
+  the latest are born around (and after) the Perth agreement.
+- Cousin marriages, where both parents of a family are descendants.
+- Missing and imprecise birth dates, dead descendants without a death date,
+  impossible dates, missing genders and private (referenced-only) children.
+- Illegitimacy rules (as in illegitimates.yml) for a proportion of
+  descendants, including rules matching nobody.
+
+The generation is vectorized with NumPy, and the rows are written directly in
+the columnar format (or as YAML, which is only practical for small sizes).
+'''
+
+import argparse
+import logging
+import time
+from uuid import NAMESPACE_X500, uuid5
+
+import numpy as np
+import yaml
+
+from columns import write_arrays
+
+logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+# Geni id of the seed, whose _id is the uuid of it (as in geni.py)
+SEED_GENI_ID = 'profile-1'
+# Birth of the seed, and the present day of the generated data
+SEED_BIRTH = '1630-10-14'
+TODAY = '2020-12-01'
+# Generations from the seed to the present
+GENERATIONS = 12
+# Proportions of descendants with each feature
+COUSIN_MARRIAGE = 0.1
+MISSING_BIRTH = 0.03
+YEAR_ONLY_BIRTH = 0.1
+MONTH_ONLY_BIRTH = 0.05
+MISSING_DEATH = 0.02
+IMPOSSIBLE_DEATH = 0.001
+MISSING_ALIVE = 0.01
+MISSING_GENDER = 0.01
+MISSING_URL = 0.01
+PRIVATE = 0.01
+ILLEGITIMATE = 0.002
+UNMATCHED_RULES = 0.1
+# Death day of the living
+ALIVE = np.iinfo(np.int64).max
+
+def seed_id():
+    return str(uuid5(NAMESPACE_X500, SEED_GENI_ID))
+
+def to_day(iso):
+    return np.datetime64(iso, 'D').astype(np.int64)
+
+def generation_sizes(size, generations=GENERATIONS):
+    '''Sizes of the generations after the seed, growing geometrically to a
+    total of size (including the seed).
+    '''
+    lo, hi = 1.0, float(max(size, 2))
+    for _ in range(100):
+        growth = (lo + hi) / 2
+        total = sum(growth ** g for g in range(1, generations + 1))
+        lo, hi = (growth, hi) if total < size - 1 else (lo, growth)
+    sizes = np.round(growth ** np.arange(1, generations + 1)).astype(np.int64)
+    sizes[-1] += size - 1 - sizes.sum()
+    return np.maximum(sizes, 0)
+
+def generate(size, seed=0):
+    '''Generate a family tree of (up to) size persons. Returns arrays of the
+    birth day, death day (ALIVE if alive), gender (0 female, 1 male) and the
+    (parent, child) edges, in generation order.
+    '''
+    rng = np.random.default_rng(seed)
+    today = to_day(TODAY)
+    birth = [np.array([to_day(SEED_BIRTH)])]
+    death = [np.array([to_day(SEED_BIRTH) + 70 * 365])]
+    gender = [np.array([0])]
+    parents, children = [], []
+    offset, generation, shortfall = 0, np.array([0]), 0
+    for target in generation_sizes(size):
+        # Make up for children of the last generation born too late
+        target += shortfall
+        n = len(generation)
+        # Families of descendants who lived to have children
+        b, d = birth[-1], death[-1]
+        lifespan = np.where(d == ALIVE, today, d) - b
+        weights = (lifespan > 18 * 365).astype(float)
+        if not weights.any() or target <= 0:
+            break
+        # Draw twice the children needed, as some are born too late
+        counts = rng.multinomial(2 * target, weights / weights.sum())
+        heads = np.repeat(np.arange(n), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        order = np.arange(len(heads)) - starts
+        # Children spaced a year or two apart from the parent's twenties
+        family_start = b + rng.integers(20 * 365, 32 * 365, n)
+        spacing = rng.integers(365, 3 * 365, n)
+        child_birth = family_start[heads] + order * spacing[heads] \
+            + rng.integers(0, 300, len(heads))
+        # Born by today, and within a pregnancy of the parent's death
+        keep = (child_birth <= today) \
+            & ((d[heads] == ALIVE) | (child_birth <= d[heads] + 270))
+        keep = np.sort(rng.permutation(np.flatnonzero(keep))[:target])
+        heads, child_birth = heads[keep], child_birth[keep]
+        m = len(heads)
+        shortfall = target - m
+        if not m:
+            break
+        # Infant mortality (except in the first small generations, so that
+        # the tree does not die out), otherwise a normal lifespan
+        infant = (rng.random(m) < 0.05) & (m > 100)
+        age = np.where(infant, rng.integers(0, 2 * 365, m),
+            np.clip(rng.normal(70, 15, m), 0, 105) * 365).astype(np.int64)
+        child_death = np.where(child_birth + age < today, child_birth + age,
+            ALIVE)
+        child_gender = rng.integers(0, 2, m)
+        ids = offset + n + np.arange(m)
+        parents.append(offset + heads)
+        children.append(ids)
+        # Cousin marriages: a family with another descendant of the
+        # parent's generation as the other parent
+        cousins = rng.random(n) < COUSIN_MARRIAGE
+        spouse = rng.integers(0, n, n)
+        cousins &= gender[-1][spouse] != gender[-1]
+        married = cousins[heads]
+        parents.append(offset + spouse[heads[married]])
+        children.append(ids[married])
+        birth.append(child_birth)
+        death.append(child_death)
+        gender.append(child_gender)
+        offset += n
+        generation = ids
+    return (np.concatenate(birth), np.concatenate(death),
+        np.concatenate(gender), np.concatenate(parents),
+        np.concatenate(children))
+
+def csr(keys, values, size):
+    '''Adjacency lists of values by key in CSR form, keeping the order of
+    values for each key.
+    '''
+    order = np.argsort(keys, kind='stable')
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=indptr[1:])
+    return indptr, values[order].astype(np.int32)
+
+def iso_dates(days, isnull):
+    dates = np.datetime_as_string(np.where(isnull, 0, days)
+        .astype('datetime64[D]'))
+    return np.where(isnull, '', dates), isnull
+
+def descendant_columns(size, seed=0):
+    '''Columns of the descendants in the format of write_arrays, as an
+    (ids, rows, columns) tuple.
+    '''
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed + 1)
+    birth, death, gender, parents, children = generate(size, seed)
+    n = len(birth)
+    # Private profiles are referenced by their parents but have no row, and
+    # are placed after the rows
+    private = rng.random(n) < PRIVATE
+    private[0] = False
+    positions = np.empty(n, dtype=np.int64)
+    positions[~private] = np.arange(n - private.sum())
+    positions[private] = np.arange(n - private.sum(), n)
+    rows = int((~private).sum())
+    persons = np.flatnonzero(~private)
+    geni_ids = [f'profile-{i + 1}' for i in range(n)]
+    ids = np.array([str(uuid5(NAMESPACE_X500, geni_id))
+        for geni_id in geni_ids], dtype=str)[np.argsort(positions)]
+    # Edges from persons with rows only
+    edges = ~private[parents] | ~private[children]
+    parents, children = parents[edges], children[edges]
+    has_row = ~private[parents]
+    children_ids = csr(positions[parents[has_row]],
+        positions[children[has_row]], rows)
+    has_row = ~private[children]
+    parent_ids = csr(positions[children[has_row]],
+        positions[parents[has_row]], rows)
+    b, d, g = birth[persons], death[persons], gender[persons]
+    # Imprecise birth dates are the start of the year or month
+    accuracy = rng.random(rows)
+    year_only = accuracy < YEAR_ONLY_BIRTH
+    month_only = ~year_only & (accuracy < YEAR_ONLY_BIRTH + MONTH_ONLY_BIRTH)
+    dates = b.astype('datetime64[D]')
+    b = np.where(year_only, dates.astype('datetime64[Y]')
+        .astype('datetime64[D]').astype(np.int64), b)
+    b = np.where(month_only, dates.astype('datetime64[M]')
+        .astype('datetime64[D]').astype(np.int64), b)
+    birth_missing = rng.random(rows) < MISSING_BIRTH
+    dead = d != ALIVE
+    # Some deaths are unrecorded or before the birth
+    death_missing = ~dead | (rng.random(rows) < MISSING_DEATH)
+    impossible = rng.random(rows) < IMPOSSIBLE_DEATH
+    alive_missing = rng.random(rows) < MISSING_ALIVE
+    gender_missing = rng.random(rows) < MISSING_GENDER
+    url_missing = rng.random(rows) < MISSING_URL
+    # The seed (row 0) is kept clean, as cleaning it out would leave no line
+    for mask in [birth_missing, impossible, alive_missing, gender_missing,
+            url_missing]:
+        mask[0] = False
+    death_missing[0] = not dead[0]
+    d = np.where(impossible, b - 365, d)
+    is_alive = np.where(alive_missing, -1,
+        (~dead).astype(np.int8)).astype(np.int8)
+    names = np.array([f'Person {i + 1}' for i in persons], dtype=str)
+    urls = np.array([f'https://www.geni.com/people/Person-{i + 1}/'
+        f'{6000000000000000000 + i}' for i in persons], dtype=str)
+    columns = {
+        'name': ('str', (names, np.zeros(rows, dtype=bool))),
+        'short_name': ('str', (names, np.zeros(rows, dtype=bool))),
+        'gender': ('str', (np.where(gender_missing, '',
+            np.where(g == 1, 'male', 'female')), gender_missing)),
+        'birth_date': ('str', iso_dates(b, birth_missing)),
+        'birth_accuracy': ('str', (np.where(birth_missing, '',
+            np.where(year_only, 'year', np.where(month_only, 'month', 'day'))),
+            birth_missing)),
+        'death_date': ('str', iso_dates(d, death_missing)),
+        'death_accuracy': ('str', (np.where(death_missing, '', 'year'),
+            death_missing)),
+        'is_alive': ('bool', is_alive),
+        'children_ids': ('ids', children_ids),
+        'parent_ids': ('ids', parent_ids),
+        'external_url': ('str', (np.where(url_missing, '', urls),
+            url_missing)),
+        '_geni_id': ('str', (np.array([geni_ids[i] for i in persons],
+            dtype=str), np.zeros(rows, dtype=bool))),
+    }
+    logging.info(f'Generated {rows} descendants ({n - rows} private) in '
+        f'{time.perf_counter() - start:.2f} seconds')
+    return ids, rows, columns
+
+def illegitimate_rules(columns, rows, seed=0):
+    '''Illegitimacy rules for a proportion of the descendants, mostly from
+    birth and otherwise from a later date (as for an abdication), along with
+    rules for profiles which are not in the data.
+    '''
+    rng = np.random.default_rng(seed + 2)
+    geni_ids = columns['_geni_id'][1][0]
+    birth_dates, birth_missing = columns['birth_date'][1]
+    count = max(3, int(rows * ILLEGITIMATE))
+    rules = []
+    for position in rng.choice(np.arange(1, rows), min(count, rows - 1),
+            replace=False):
+        date = None
+        if rng.random() < 0.2 and not birth_missing[position]:
+            born = np.datetime64(birth_dates[position], 'D')
+            date = str(born + int(rng.integers(18 * 365, 60 * 365)))
+        rules.append({'date': date, 'match': {
+            '_wt_id': int(rng.integers(10 ** 6, 10 ** 7)),
+            '_geni_id': str(geni_ids[position]),
+        }})
+    for _ in range(int(count * UNMATCHED_RULES)):
+        rules.append({'date': None, 'match': {
+            '_geni_id': f'profile-{int(rng.integers(10 ** 9, 10 ** 10))}',
+        }})
+    return rules
+
+def rows_from_columns(ids, rows, columns):
+    '''Rows (a list of dicts) of the columns, for the YAML format.
+    '''
+    data = {}
+    for key, (kind, arrays) in columns.items():
+        if kind == 'ids':
+            indptr, indices = arrays
+            data[key] = [ids[indices[indptr[i]:indptr[i+1]]].tolist()
+                for i in range(rows)]
+        elif kind == 'bool':
+            data[key] = [None if v < 0 else bool(v) for v in arrays.tolist()]
+        else:
+            values, isnull = arrays
+            data[key] = [None if null else value
+                for value, null in zip(values.tolist(), isnull.tolist())]
+    return [dict({'_id': _id}, **{key: data[key][i] for key in data})
+        for i, _id in enumerate(ids[:rows].tolist())]
+
+def write(size, seed=0, columns_path=None, yaml_path=None,
+        illegitimates_path=None):
+    '''Generate a genealogy and write it out. Returns the number of rows.
+    '''
+    ids, rows, columns = descendant_columns(size, seed)
+    if columns_path:
+        logging.info(f'Writing {rows} rows to {columns_path}...')
+        write_arrays(columns_path, ids, rows, columns)
+    if yaml_path:
+        logging.info(f'Dumping {rows} rows to {yaml_path}...')
+        with open(yaml_path, 'w+') as f:
+            yaml.dump(rows_from_columns(ids, rows, columns), f, indent=2,
+                sort_keys=True)
+    if illegitimates_path:
+        rules = illegitimate_rules(columns, rows, seed)
+        logging.info(f'Writing {len(rules)} illegitimacy rules to '
+            f'{illegitimates_path}...')
+        with open(illegitimates_path, 'w+') as f:
+            yaml.dump(rules, f, sort_keys=False)
+    return rows
+
+def main():
+
+    # Define and parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000,
+        help='Number of descendants (approximately).')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Random seed.')
+    parser.add_argument('--columns', type=str, default=None,
+        help='Directory for the rows in columnar format.')
+    parser.add_argument('--output', type=str, default=None,
+        help='YAML file for the rows (slow for large sizes).')
+    parser.add_argument('--illegitimates', type=str, default=None,
+        help='YAML file for the illegitimacy rules.')
+    args = parser.parse_args()
+
+    write(args.size, args.seed, args.columns, args.output,
+        args.illegitimates)
+    logging.info(f'The seed is {seed_id()}')
+
+if __name__ == '__main__':
+    main()
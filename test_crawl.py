@@ -0,0 +1,77 @@
+'''Checks of geni.py against the simulated Geni API (geni_sim.py): a crawl
+with faults stores the whole tree, and failed or interrupted runs are
+completed by --resume or --previous rather than finishing partially.
+
+    python -m unittest test_crawl
+'''
+
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import geni
+import geni_sim
+
+class CrawlTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.ERROR)
+        self.profiles, self.unions = geni_sim.synthetic_tree(800, seed=3)
+        self.geni = geni_sim.SimulatedGeni(self.profiles, self.unions,
+            limit=1000, window=1, latency=0.001, error_rate=0.2,
+            throttle_rate=0.05, seed=1)
+        self.server = geni_sim.serve(self.geni)
+        self.directory = tempfile.TemporaryDirectory()
+        # Retry quickly
+        patcher = mock.patch.object(geni, 'BACKOFF_BASE', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def crawl(self, db, *arguments):
+        geni.main(geni.parse_arguments(['--seed', 'profile-1',
+            '--base-url', f'http://127.0.0.1:{self.server.server_port}/api',
+            '--db', self.path(db), '--output', '', *arguments]))
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def assertComplete(self, db):
+        profiles, unions = geni.read_tables(self.path(db))
+        self.assertEqual(set(profiles), set(self.profiles))
+        self.assertEqual(set(unions), set(self.unions))
+
+    def test_crawl_with_faults(self):
+        for engine in ['threads', 'async']:
+            with self.subTest(engine=engine):
+                self.crawl(f'{engine}.db', '--engine', engine,
+                    '--workers', '3')
+                self.assertComplete(f'{engine}.db')
+
+    def test_resume_after_failed_requests(self):
+        self.geni.error_rate = 0.4
+        with mock.patch.object(geni, 'MAX_ATTEMPTS', 1):
+            with self.assertRaises(SystemExit) as exit:
+                self.crawl('geni.db')
+        self.assertEqual(exit.exception.code, 1)
+        self.geni.error_rate = 0
+        self.crawl('geni.db', '--resume')
+        self.assertComplete('geni.db')
+
+    def test_previous_with_missing_documents(self):
+        # A partial previous database with nothing stale
+        self.geni.error_rate = 0
+        with self.assertRaises(SystemExit):
+            self.crawl('previous.db', '--max-requests', '3')
+        self.crawl('geni.db', '--previous', self.path('previous.db'),
+            '--max-age', '1000', '--living-max-age', '1000')
+        self.assertComplete('geni.db')
+
+if __name__ == '__main__':
+    unittest.main()
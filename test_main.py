@@ -0,0 +1,131 @@
+'''Checks of the incremental succession (SuccessionCache) against the full
+succession of a synthetic tree (synth.py): after the descendants change, an
+update gives exactly the entries and depths of SuccessionGraph.succession, or
+gives up when a block loses successors or successors move into a block.
+
+    python -m unittest test_main
+'''
+
+import logging
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from main import (SuccessionCache, SuccessionGraph, apply_illegitimates,
+    clean_descendants, descendant_signatures)
+import synth
+
+class SuccessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.ERROR)
+        ids, rows, columns = synth.descendant_columns(3000, seed=5)
+        df = pd.DataFrame(synth.rows_from_columns(ids, rows, columns)) \
+            .set_index('_id')
+        apply_illegitimates(df, synth.illegitimate_rules(columns, rows))
+        self.df = clean_descendants(df)
+        self.df['legitimate_date'] = None
+        self.seed = synth.seed_id()
+        graph, self.entries, self.depths = self.succession(self.df)
+        self.cache = SuccessionCache.from_graph(graph, self.seed,
+            descendant_signatures(self.df), self.entries, self.depths)
+        self.rng = np.random.default_rng(7)
+
+    def succession(self, df):
+        graph = SuccessionGraph(df)
+        depths = []
+        entries = graph.succession(graph.node(self.seed), depths)
+        return graph, entries, depths
+
+    def update(self, df):
+        '''The update of the cached succession for the changed descendants,
+        checked against the full succession if the update was possible.
+        '''
+        graph, entries, depths = self.succession(df)
+        update = self.cache.update(graph, self.seed, df,
+            descendant_signatures(df))
+        if update is not None:
+            self.assertEqual(update, (entries, depths))
+        return update
+
+    def line_ids(self):
+        return [self.df.index[node] for node, _, _ in self.entries]
+
+    def add_child(self, df, parent, _id, birth_date):
+        row = df.loc[parent].copy()
+        row['birth_date'] = birth_date
+        row['illegitimate_date'] = None
+        row['children_ids'] = []
+        df.loc[_id] = row
+        df.at[parent, 'children_ids'] = df.at[parent, 'children_ids'] + [_id]
+
+    def test_unchanged(self):
+        self.assertEqual(self.update(self.df.copy()),
+            (self.entries, self.depths))
+
+    def test_new_child(self):
+        # A child born to the last in line only extends the line
+        df = self.df.copy()
+        last = self.line_ids()[-1]
+        self.add_child(df, last, 'new-child', '2024-01-01')
+        self.assertIsNotNone(self.update(df))
+
+    def test_random_changes(self):
+        ids = self.line_ids()
+        for trial in range(10):
+            with self.subTest(trial=trial):
+                df = self.df.copy()
+                for _id in self.rng.choice(ids, 3, replace=False):
+                    change = self.rng.integers(4)
+                    if change == 0:
+                        born = np.datetime64(df.at[_id, 'birth_date'], 'D')
+                        df.at[_id, 'birth_date'] = str(born
+                            + int(self.rng.integers(-3000, 3000)))
+                    elif change == 1:
+                        df.at[_id, 'gender'] = {'male': 'female'}.get(
+                            df.at[_id, 'gender'], 'male')
+                    elif change == 2:
+                        self.add_child(df, _id, f'new-{trial}-{_id}',
+                            '1990-01-01')
+                    elif df.at[_id, 'children_ids']:
+                        df.at[_id, 'children_ids'] = \
+                            df.at[_id, 'children_ids'][1:]
+                self.update(df)
+
+    def test_block_loses_successors(self):
+        # Disown a child with a single parent, so it leaves the line
+        df = self.df.copy()
+        ids = self.line_ids()
+        for child in ids[1:]:
+            parents = [p for p in df.at[child, 'parent_ids'] if p in df.index]
+            if len(parents) == 1 and ids.count(child) == 1:
+                break
+        parent = parents[0]
+        df.at[parent, 'children_ids'] = [c for c in
+            df.at[parent, 'children_ids'] if c != child]
+        with self.assertLogs(level='INFO') as logs:
+            self.assertIsNone(self.update(df))
+        self.assertIn(f'Successors removed from the block of {parent}',
+            '\n'.join(logs.output))
+
+    def test_successors_move_into_block(self):
+        # Adopt a later successor into the family of an earlier one
+        df = self.df.copy()
+        ids = self.line_ids()
+        legitimate = [i is None for _, i, _ in self.entries]
+        parent = next(_id for _id, l in zip(ids[1:], legitimate[1:]) if l)
+        start = ids.index(parent)
+        end = self.cache.block_end(start)
+        child = next(_id for _id, l in zip(ids[end:], legitimate[end:])
+            if l and ids.count(_id) == 1
+            and df.at[_id, 'illegitimate_date'] is None)
+        df.at[parent, 'children_ids'] = \
+            df.at[parent, 'children_ids'] + [child]
+        with self.assertLogs(level='INFO') as logs:
+            self.assertIsNone(self.update(df))
+        self.assertIn(f'Successors moved into the block of {parent}',
+            '\n'.join(logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,13 +8,19 @@ git pull && \
 pip install -r requirements.txt && \
 # Run the data gathering and succession calculation scripts
 # Retain the previous successful raw responses database
-if [ -f db.json ]; then mv -f db.json db-previous.json; fi && \
-rm -f _TEMP.json && \
-python geni.py --seed "profile-56847813" --db _TEMP.json --workers 6 && \
-mv _TEMP.json db.json && \
-python main.py --descendants geni.yml --seed "0557aac6-264c-5a83-8f1e-a3f6cfac8b9a" && \
-# Copy the successors file to the website static directory
-\cp -fa ./successors.json ./web/static/ && \
+if [ -f geni.db ]; then mv -f geni.db geni-previous.db; fi && \
+# Incrementally update from the previous database if there is one (or the 
+# legacy TinyDB database on the first run after upgrading), and resume the 
+# last run if it did not finish
+PREVIOUS=$(if [ -f geni-previous.db ]; then echo "--previous geni-previous.db"; elif [ -f db.json ]; then echo "--previous db.json"; fi) && \
+RESUME=$(if [ -f _TEMP.db ]; then echo "--resume"; fi) && \
+# Request the profiles highest in the last line first
+SUCCESSORS=$(if [ -f successors.json ]; then echo "--previous-successors successors.json"; fi) && \
+python geni.py --seed "profile-56847813" --db _TEMP.db --workers 6 --columns geni-columns --metrics-file geni-metrics.json $PREVIOUS $RESUME $SUCCESSORS && \
+mv _TEMP.db geni.db && \
+python main.py --descendants geni-columns --seed "0557aac6-264c-5a83-8f1e-a3f6cfac8b9a" --cache succession.pkl --metrics-file main-metrics.json && \
+# Copy the successors, timeline and history files to the website static directory
+\cp -fa ./successors.json ./timeline.json ./histories.json ./web/static/ && \
 # Exit the Python virtual environment
 deactivate && \
 # Build the latest version of the website